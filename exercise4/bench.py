@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+""" Benchmark the die converters over a grid of source and target sides.
+
+For each converter this reports rolls per second, source rolls consumed per
+output and peak memory, and can save the results as JSON and compare them
+with a previous run:
+
+    ./bench.py --output new.json --compare old.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from dice import Die, DieCombo, DieDivider, DieEntropy, DieFactor, DiePower, compile_die, factor_rolls, plan_die
+
+# (source sides, sides) pairs, from small dice up to large targets.
+GRID = [
+    (6, 3),
+    (12, 4),
+    (6, 12),
+    (6, 16),
+    (10, 45),
+    (10, 50),
+    (10, 80),
+    (6, 200),
+    (8, 4000),
+    (6, 1000000),
+    (20, 1000000),
+]
+
+def converters(source_sides, sides):
+    """ Yield (name, factory) for every converter that can make sides from source_sides. """
+    if source_sides % sides == 0:
+        yield 'DieDivider', lambda source: DieDivider(sides=sides, source=source)
+    yield 'DiePower', lambda source: DiePower(sides=sides, source=source)
+    yield 'DieCombo', lambda source: DieCombo(sides=sides, source=source)
+    yield 'DieFused', lambda source: compile_die(DieCombo(sides=sides, source=source))
+    if factor_rolls(source_sides, sides) is not None:
+        yield 'DieFactor', lambda source: DieFactor(sides=sides, source=source)
+    yield 'DieEntropy', lambda source: DieEntropy(sides=sides, source=source)
+    yield 'planned', lambda source: plan_die(source, sides)
+
+def roll(die, count, mode):
+    if mode == 'batch':
+        die.roll_batch(count)
+    else:
+        die(count=count)
+
+def measure(factory, source_sides, count, mode, repeat):
+    """ Roll count times and return the best time, source rolls per output and peak memory. """
+    best = None
+    for i in range(0, repeat):
+        source = Die(sides=source_sides, seed=i)
+        die = factory(source)
+
+        start = time.perf_counter()
+        roll(die, count, mode)
+        seconds = time.perf_counter() - start
+
+        if best is None or seconds < best[0]:
+            best = (seconds, source.num_outputs / count)
+
+    # tracemalloc slows down allocation, so the memory is measured in a separate, untimed pass.
+    die = factory(Die(sides=source_sides, seed=0))
+    tracemalloc.start()
+    roll(die, count, mode)
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best + (peak,)
+
+def run(count, repeat, scalar_count):
+    results = []
+
+    for sides in sorted(set(sides for (source_sides, sides) in GRID)):
+        results.append(result('Die', 0, sides, 'batch', count, measure(lambda source: source, sides, count, 'batch', repeat)))
+
+    for (source_sides, sides) in GRID:
+        for (name, factory) in converters(source_sides, sides):
+            # DieEntropy is sequential, it only has the scalar path.
+            modes = ['scalar'] if name == 'DieEntropy' else ['batch', 'scalar']
+            for mode in modes:
+                n = count if mode == 'batch' else scalar_count
+                results.append(result(name, source_sides, sides, mode, n, measure(factory, source_sides, n, mode, repeat)))
+
+    return results
+
+def result(name, source_sides, sides, mode, count, measured):
+    (seconds, source_rolls, peak) = measured
+    r = {
+        'name': name,
+        'source_sides': source_sides,
+        'sides': sides,
+        'mode': mode,
+        'count': count,
+        'seconds': seconds,
+        'rolls_per_second': count / seconds if seconds else float('inf'),
+        'source_rolls_per_output': source_rolls,
+        'peak_bytes': peak,
+    }
+    print('{name: <10} d{sides: <8} from d{source_sides: <3} {mode: <6} {rolls_per_second: >14,.0f}/s {source_rolls_per_output: >7.3f} rolls/output {peak_bytes: >12,} bytes'.format(**r))
+    return r
+
+def key(r):
+    return (r['name'], r['source_sides'], r['sides'], r['mode'])
+
+def compare(results, baseline, threshold):
+    """ Return the results that got slower or more wasteful than the baseline. """
+    old = {key(r): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        b = old.get(key(r))
+        if b is None:
+            continue
+
+        if r['rolls_per_second'] < b['rolls_per_second'] * (1 - threshold):
+            regressions.append((r, 'rolls_per_second', b['rolls_per_second'], r['rolls_per_second']))
+        if r['source_rolls_per_output'] > b['source_rolls_per_output'] * (1 + threshold):
+            regressions.append((r, 'source_rolls_per_output', b['source_rolls_per_output'], r['source_rolls_per_output']))
+        if r['peak_bytes'] > b['peak_bytes'] * (1 + threshold) + 65536:
+            regressions.append((r, 'peak_bytes', b['peak_bytes'], r['peak_bytes']))
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=1000000, help='rolls per batched measurement')
+    parser.add_argument('--scalar-count', type=int, default=20000, help='rolls per scalar measurement')
+    parser.add_argument('--repeat', type=int, default=3, help='keep the best of this many runs')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='compare with the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    results = run(count=args.count, repeat=args.repeat, scalar_count=args.scalar_count)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'machine': platform.machine(),
+                'time': time.time(),
+                'results': results,
+            }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for (r, metric, before, after) in regressions:
+            print('REGRESSION {} d{} from d{} {}: {} {:.4g} -> {:.4g}'.format(r['name'], r['sides'], r['source_sides'], r['mode'], metric, before, after))
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,18 +1,50 @@
 #!/usr/bin/env python3
 from __future__ import division
+import copy
+import functools
 import itertools
+import json
 import logging
 import math
-import random
+import mmap
+import os
+import pickle
+import re
+import struct
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
 
+import numpy as np
+
 from collections import deque
+from collections import namedtuple
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+
+# Converter tables up to this size are counted entry by entry by verify_uniform.
+MAX_TABLE = 16777216
+
+def seed_sequence(seed):
+    """ Return seed as a SeedSequence, as it is if it already is one. """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
 
 class DieBase:
     def __init__(self, sides, source=None):
         self._sides = sides
         self.source = source
 
+        # Instrumentation, see stats() and report().
+        self.num_outputs = 0
+        self.num_source_rolls = 0
+        self.num_rejections = 0
+        self.num_iterations = 0
+
     @property
     def sides(self):
         return self._sides
@@ -23,40 +55,159 @@ class DieBase:
     def __call__(self, count=1):
         return [self.roll() for i in range(0, count)]
 
+    def roll_batch(self, count=1):
+        """ Return count rolls as a numpy integer array. """
+        return np.fromiter((self.roll() for i in range(0, count)), dtype=np.int64, count=count)
+
+    def stream(self, chunk_size=65536, count=None):
+        """ Yield rolls as arrays of at most chunk_size, count rolls in total or forever.
+
+        Each chunk is only rolled when it is asked for, so memory stays flat
+        and a consumer that stops early takes no further rolls from the source.
+        """
+        while count is None or count > 0:
+            n = chunk_size if count is None else min(chunk_size, count)
+            yield self.roll_batch(n)
+            if count is not None:
+                count -= n
+
+    def reseed(self, seed):
+        """ Give every random die in the source chain a new seed. """
+        if self.source is not None:
+            self.source.reseed(seed)
+
+    @property
+    def bits_consumed(self):
+        """ Entropy taken from the source, in bits. """
+        if self.source is None:
+            return 0.0
+        return self.num_source_rolls * math.log2(self.source.sides)
+
+    @property
+    def bits_produced(self):
+        """ Entropy in the rolls returned, in bits. """
+        return self.num_outputs * math.log2(self.sides)
+
+    @property
+    def efficiency(self):
+        """ Fraction of the consumed entropy that ends up in the rolls. """
+        if not self.bits_consumed:
+            return math.nan
+        return self.bits_produced / self.bits_consumed
+
+    def stats(self):
+        return {
+            'outputs': self.num_outputs,
+            'source_rolls': self.num_source_rolls,
+            'rejections': self.num_rejections,
+            'iterations': self.num_iterations,
+            'bits_consumed': self.bits_consumed,
+            'bits_produced': self.bits_produced,
+            'efficiency': self.efficiency,
+        }
+
+    def sources(self):
+        """ Return the dice this die takes rolls from. """
+        return [self.source] if self.source is not None else []
+
+    def check(self, max_table=MAX_TABLE):
+        """ Return a StageCheck of how this die maps its source rolls. """
+        raise Exception('Cannot verify {}, it is not a deterministic converter.'.format(type(self).__name__))
+
+    def verify(self, max_table=MAX_TABLE):
+        """ Return a Verification of this die, see verify_uniform.
+
+        A die without sources is assumed to be uniform. A die with a source
+        describes how it maps the source rolls with check(), which raises an
+        Exception for a die that is not a deterministic converter.
+        """
+        if not self.sources():
+            return Verification(True, Fraction(1), [self], [])
+        check = self.check(max_table)
+        return chain_verification(self.source.verify(max_table), [check])
+
+    def report(self, depth=0):
+        """ Describe the counters of this die and every die in its source chain. """
+        a = ['{}{}(sides={}): outputs={}, source_rolls={}, rejections={}, iterations={}, bits_consumed={:.1f}, bits_produced={:.1f}, efficiency={:.3f}'.format(
+            '  ' * depth, type(self).__name__, self.sides, self.num_outputs, self.num_source_rolls, self.num_rejections, self.num_iterations,
+            self.bits_consumed, self.bits_produced, self.efficiency)]
+        for source in self.sources():
+            a.append(source.report(depth + 1))
+        return '\n'.join(a)
+
     def __str__(self):
         return 'sides={}, source=({})'.format(self.sides, self.source)
 
+class TestStream(unittest.TestCase):
+    def test_chunks(self):
+        die = DiePerfect(sides=6)
+        chunks = list(die.stream(chunk_size=4, count=10))
+        self.assertEqual([len(c) for c in chunks], [4, 4, 2])
+        self.assertEqual(np.concatenate(chunks).tolist(), [1, 2, 3, 4, 5, 6, 1, 2, 3, 4])
+
+    def test_stop_early(self):
+        source = DiePerfect(sides=10, num_dice=2)
+        die = DieCombo(sides=45, source=source)
+        for (i, chunk) in enumerate(die.stream(chunk_size=45)):
+            if i == 1:
+                break
+        self.assertEqual(die.num_outputs, 90)
+        self.assertEqual(source.num_rolls, 180)
+
+    def test_tester(self):
+        die = DieDivider(sides=3, source=Die(sides=6, seed=1))
+        tester = DieTester(die)
+        tester.consume(die.stream(chunk_size=1000, count=10500))
+        self.assertEqual(tester.num_rolls, 10500)
+        self.assertEqual(die.source.num_outputs, 10500)
+
 class DiePerfect(DieBase):
+    """ A deterministic die that cycles through every combination of num_dice rolls.
+
+    The sequence is a mixed-radix counter over num_dice digits, so only the
+    position is stored and any offset can be reached with seek().
+    """
     def __init__(self, sides, num_dice=1):
         super(DiePerfect, self).__init__(sides=sides, source=None)
         self.num_dice = num_dice
         self.num_rolls = 0
 
-        ranges = [range(1, sides + 1) for n in range(0, self.num_dice)]
-        self.rolls = itertools.cycle(DiePerfect.__each(current=[], ranges=deque(ranges)))
-
-    @staticmethod
-    def __each(current, ranges):
-        if not len(ranges):
-            return current
-
-        range = ranges.popleft()
+        # Weight of each digit within one combination, most significant first.
+        self.weights = [pow(self.sides, self.num_dice - k - 1) for k in range(0, self.num_dice)]
+        self.period = pow(self.sides, self.num_dice) * self.num_dice
+        self._position = 0
 
-        results = []
-        for i in range:
-            current.append(i)
-            results.extend(DiePerfect.__each(current, ranges))
-            current.pop()
+    @property
+    def position(self):
+        return self._position
 
-        ranges.appendleft(range)
+    def seek(self, n):
+        self._position = n % self.period
 
-        return results
+    def at(self, n):
+        combo, digit = divmod(n % self.period, self.num_dice)
+        return (combo // self.weights[digit]) % self.sides + 1
 
     def roll(self):
         self.num_rolls += 1
-        r = next(self.rolls)
+        self.num_outputs += 1
+        r = self.at(self._position)
+        self.seek(self._position + 1)
         return r
 
+    def roll_batch(self, count=1):
+        if self.period >= np.iinfo(np.int64).max // 2:
+            return super(DiePerfect, self).roll_batch(count)
+
+        positions = (self._position + np.arange(count, dtype=np.int64)) % self.period
+        combos, digits = np.divmod(positions, self.num_dice)
+        weights = np.array(self.weights, dtype=np.int64)
+
+        self.num_rolls += count
+        self.num_outputs += count
+        self.seek(self._position + count)
+        return (combos // weights[digits]) % self.sides + 1
+
 class TestDiePerfect(unittest.TestCase):
     def test2d2(self):
         die = DiePerfect(sides=2, num_dice=2)
@@ -66,23 +217,211 @@ class TestDiePerfect(unittest.TestCase):
         die = DiePerfect(sides=4, num_dice=2)
         self.assertEqual(die(count=32), [1, 1, 1, 2, 1, 3, 1, 4, 2, 1, 2, 2, 2, 3, 2, 4, 3, 1, 3, 2, 3, 3, 3, 4, 4, 1, 4, 2, 4, 3, 4, 4])
 
+    def test_cycle(self):
+        die = DiePerfect(sides=3, num_dice=2)
+        self.assertEqual(die(count=18), die(count=18))
+
+    def test_seek(self):
+        die = DiePerfect(sides=4, num_dice=2)
+        die.seek(13)
+        self.assertEqual(die.position, 13)
+        self.assertEqual(die(count=5), [3, 2, 4, 3, 1])
+        self.assertEqual(die.position, 18)
+
+    def test_roll_batch(self):
+        die = DiePerfect(sides=4, num_dice=2)
+        rolls = die(count=7) + list(die.roll_batch(count=40))
+        die.seek(0)
+        self.assertEqual(rolls, die(count=47))
+        self.assertEqual(die.num_rolls, 94)
+
+    def test6d20(self):
+        die = DiePerfect(sides=20, num_dice=6)
+        die.seek(die.period - 6)
+        self.assertEqual(die(count=8), [20, 20, 20, 20, 20, 20, 1, 1])
+
+StatisticResult = namedtuple('StatisticResult', ['statistic', 'p_value'])
+# The result of a test that has no rolls to work with.
+NO_RESULT = StatisticResult(math.nan, math.nan)
+
+Certification = namedtuple('Certification', ['verdict', 'num_rolls', 'statistic', 'bound'])
+
+def gamma_q(a, x):
+    """ Regularized upper incomplete gamma function Q(a, x). """
+    if math.isnan(x) or math.isnan(a):
+        return math.nan
+    if x <= 0:
+        return 1.0
+    if a > 100000:
+        # Wilson-Hilferty: (x / a) ** (1 / 3) is close to normal for large a.
+        return normal_sf((pow(x / a, 1 / 3) - 1 + 1 / (9 * a)) * math.sqrt(9 * a))
+
+    # Both expansions need about sqrt(a) terms near x = a.
+    max_terms = int(100 * math.sqrt(a)) + 10000
+    lg = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        # Series for P(a, x).
+        term = total = 1 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15 and n < a + max_terms:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1 - total * math.exp(lg))
+
+    # Continued fraction for Q(a, x), using the modified Lentz method.
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, max_terms + 1):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return math.exp(lg) * h
+
+def chi_square_sf(x, df):
+    """ Probability of a chi-square statistic at least x with df degrees of freedom. """
+    return gamma_q(df / 2, x / 2)
+
+def normal_sf(z):
+    """ Probability of a standard normal value at least z. """
+    return math.erfc(z / math.sqrt(2)) / 2
+
+def kolmogorov_sf(t):
+    """ Probability of the Kolmogorov distribution exceeding t. """
+    if t < 0.2:
+        return 1.0
+    p = 0
+    for j in range(1, 101):
+        term = 2 * pow(-1, j - 1) * math.exp(-2 * pow(j * t, 2))
+        p += term
+        if abs(term) < 1e-16:
+            break
+    return min(1.0, max(0.0, p))
+
+class TestStatistics(unittest.TestCase):
+    def test_chi_square_sf(self):
+        self.assertAlmostEqual(chi_square_sf(3.841459, 1), 0.05, places=6)
+        self.assertAlmostEqual(chi_square_sf(18.307038, 10), 0.05, places=6)
+        self.assertAlmostEqual(chi_square_sf(2, 2), math.exp(-1), places=12)
+        self.assertAlmostEqual(chi_square_sf(0, 5), 1)
+
+    def test_normal_sf(self):
+        self.assertAlmostEqual(normal_sf(0), 0.5)
+        self.assertAlmostEqual(normal_sf(1.959964), 0.025, places=6)
+
+    def test_large_df(self):
+        self.assertAlmostEqual(chi_square_sf(pow(10, 8), pow(10, 8)), 0.5, places=4)
+        self.assertAlmostEqual(chi_square_sf(pow(10, 8) + 20000, pow(10, 8)), normal_sf(20000 / math.sqrt(2 * pow(10, 8))), places=4)
+
+        # The series and the approximation agree where they meet.
+        for x in (199000, 200000, 201000):
+            self.assertAlmostEqual(chi_square_sf(x, 199998), chi_square_sf(x * 1.00002, 200002), places=3)
+
+    def test_nan(self):
+        self.assertTrue(math.isnan(chi_square_sf(math.nan, 5)))
+        self.assertTrue(math.isnan(gamma_q(2.5, math.nan)))
+
+    def test_kolmogorov_sf(self):
+        self.assertAlmostEqual(kolmogorov_sf(1.358099), 0.05, places=5)
+        self.assertAlmostEqual(kolmogorov_sf(0.1), 1)
+
 class DieTester:
-    def __init__(self, die):
+    """ Collect rolls from a die and test them against their expected distribution.
+
+    Rolls run from die.minimum, or 1, up to die.sides. They are expected to be
+    uniform unless the probability of each value is given in expected, for
+    example from distribution().
+
+    Everything is kept in constant memory: the count of each roll, running
+    totals and, for each lag in lags, the last rolls seen plus a sides by
+    sides histogram of pairs (x[i], x[i + lag]). The histogram is only kept
+    while it has at most max_pairs cells, so serial_test() needs a die with
+    at most 2048 sides by default, while serial_correlation() works for any.
+    """
+    def __init__(self, die, batch_size=65536, lags=(), expected=None, max_pairs=4194304):
         self.die = die
-        self.rolls = {i:0 for i in range(1, self.die.sides+1)}
+        self.batch_size = batch_size
+        self.lags = tuple(lags)
+        self.minimum = getattr(die, 'minimum', 1)
+        self.size = self.die.sides - self.minimum + 1
+
+        # Counts for each roll, index 0 holds the count of the minimum roll.
+        self.rolls = np.zeros(self.size, dtype=np.int64)
+        self._num_rolls = 0
+        self._sum = 0
+        self._sum_squares = 0
+
+        self.uniform = expected is None
+        if self.uniform:
+            # Moments of a uniform die from minimum to sides.
+            self.expected = np.full(self.size, 1 / self.size)
+            self._theorectial_average = (self.minimum + self.die.sides) / 2
+            self._theoretical_variance = (pow(self.size, 2) - 1) / 12
+        else:
+            self.expected = np.asarray(expected, dtype=np.float64)
+            if len(self.expected) != self.size:
+                raise Exception('Expected {} probabilities for rolls from {} to {}, not {}.'.format(self.size, self.minimum, self.die.sides, len(self.expected)))
+            values = np.arange(self.minimum, self.die.sides + 1)
+            self._theorectial_average = float(values @ self.expected)
+            self._theoretical_variance = float((values * values) @ self.expected) - pow(self._theorectial_average, 2)
+
+        # Serial statistics for each lag.
+        self.tail = np.empty(0, dtype=np.int64)
+        keep = pow(self.size, 2) <= max_pairs
+        self.pairs = {lag: np.zeros((self.size, self.size), dtype=np.int64) if keep else None for lag in self.lags}
+        self._num_pairs = {lag: 0 for lag in self.lags}
+        self._sum_products = {lag: 0 for lag in self.lags}
 
     def __call__(self, count=1):
-        rolls = self.die(count=count)
-        for roll in rolls:
-            self.rolls[roll] += 1
+        self.consume(self.die.stream(chunk_size=self.batch_size, count=count))
+
+    def consume(self, chunks):
+        """ Add every batch of rolls from an iterable, such as DieBase.stream(). """
+        for rolls in chunks:
+            self.update(rolls)
+
+    def update(self, rolls):
+        """ Add a batch of rolls to the counts and running totals. """
+        rolls = np.asarray(rolls, dtype=np.int64)
+        self.rolls += np.bincount(rolls - self.minimum, minlength=self.size)
+        self._num_rolls += len(rolls)
+        self._sum += int(rolls.sum())
+        self._sum_squares += int((rolls * rolls).sum())
+
+        if not self.lags:
+            return
+
+        # Pair each new roll with the roll lag places before it, which may
+        # have been seen in a previous batch.
+        rolls = np.concatenate([self.tail, rolls])
+        for lag in self.lags:
+            first = max(len(self.tail), lag)
+            a = rolls[first - lag:len(rolls) - lag]
+            b = rolls[first:]
+            if self.pairs[lag] is not None:
+                np.add.at(self.pairs[lag].ravel(), (a - self.minimum) * self.size + (b - self.minimum), 1)
+            self._num_pairs[lag] += len(b)
+            self._sum_products[lag] += int((a * b).sum())
+        self.tail = rolls[-max(self.lags):]
 
     @property
     def num_rolls(self):
-        return sum(self.rolls.values())
+        return self._num_rolls
 
     @property
     def sum(self):
-        return sum([k * v for k, v in self.rolls.items()])
+        return self._sum
 
     @property
     def average(self):
@@ -91,9 +430,20 @@ class DieTester:
         else:
             return math.nan
 
+    @property
+    def variance(self):
+        if self.num_rolls:
+            return self._sum_squares / self.num_rolls - pow(self.average, 2)
+        else:
+            return math.nan
+
     @property
     def theorectial_average(self):
-        return sum([i for i in range(1, self.die.sides + 1)]) / self.die.sides
+        return self._theorectial_average
+
+    @property
+    def theoretical_variance(self):
+        return self._theoretical_variance
 
     @property
     def average_deviation(self):
@@ -101,7 +451,101 @@ class DieTester:
 
     @property
     def exp(self):
-        return self.num_rolls / self.die.sides
+        return self.num_rolls / self.size
+
+    def impossible(self):
+        """ Return True if a roll was seen that has no chance of happening. """
+        return bool(self.rolls[self.expected <= 0].any())
+
+    def chi_square(self):
+        """ Pearson's chi-square test of the counts against the expected distribution. """
+        if not self.num_rolls:
+            return NO_RESULT
+        if self.impossible():
+            return StatisticResult(math.inf, 0.0)
+        possible = self.expected > 0
+        e = self.num_rolls * self.expected[possible]
+        statistic = float(((self.rolls[possible] - e) ** 2 / e).sum())
+        return StatisticResult(statistic, chi_square_sf(statistic, possible.sum() - 1))
+
+    def g_test(self):
+        """ Likelihood-ratio (G) test of the counts against the expected distribution. """
+        if not self.num_rolls:
+            return NO_RESULT
+        if self.impossible():
+            return StatisticResult(math.inf, 0.0)
+        seen = self.rolls > 0
+        observed = self.rolls[seen]
+        statistic = float(2 * (observed * np.log(observed / (self.num_rolls * self.expected[seen]))).sum())
+        return StatisticResult(statistic, chi_square_sf(statistic, (self.expected > 0).sum() - 1))
+
+    def ks_test(self):
+        """ Kolmogorov-Smirnov test of the counts against the expected distribution.
+
+        The p-value uses the continuous Kolmogorov distribution, which is
+        conservative for a discrete die.
+        """
+        if not self.num_rolls:
+            return NO_RESULT
+        observed = np.cumsum(self.rolls) / self.num_rolls
+        expected = np.arange(1, self.size + 1) / self.size if self.uniform else np.cumsum(self.expected)
+        statistic = float(np.abs(observed - expected).max())
+        n = math.sqrt(self.num_rolls)
+        return StatisticResult(statistic, kolmogorov_sf((n + 0.12 + 0.11 / n) * statistic))
+
+    def serial_correlation(self, lag=1):
+        """ Correlation between rolls lag places apart, with a two-sided p-value. """
+        n = self._num_pairs[lag]
+        if not n:
+            return NO_RESULT
+        r = (self._sum_products[lag] / n - pow(self.theorectial_average, 2)) / self.theoretical_variance
+        return StatisticResult(r, 2 * normal_sf(abs(r) * math.sqrt(n)))
+
+    def serial_test(self, lag=1):
+        """ Good's serial test on the histogram of pairs lag places apart. """
+        if self.pairs[lag] is None:
+            raise Exception('No histogram of pairs is kept for a die with {} sides.'.format(self.size))
+        possible = self.expected > 0
+        pairs = self.pairs[lag][possible][:, possible]
+        n = pairs.sum()
+        if not n:
+            return NO_RESULT
+        e2 = n * np.outer(self.expected[possible], self.expected[possible])
+        e1 = n * self.expected[possible]
+        statistic = float(((pairs - e2) ** 2 / e2).sum() - ((pairs.sum(axis=1) - e1) ** 2 / e1).sum())
+        m = int(possible.sum())
+        return StatisticResult(statistic, chi_square_sf(statistic, m * (m - 1)))
+
+    def certify(self, tolerance=0.01, confidence=0.99, max_rolls=10000000, batch_size=1000):
+        """ Roll in growing batches until the die is certified or the budget runs out.
+
+        After each batch the distance between the observed and expected CDF,
+        see ks_test, is compared with a Dvoretzky-Kiefer-Wolfowitz confidence
+        band. The k-th check uses (1 - confidence) / (k * (k + 1)) so the
+        overall error stays within 1 - confidence however many checks are made.
+
+        The verdict is 'fail' when the die is outside the band, 'pass' when
+        the whole band is within tolerance of the expected CDF, and
+        'inconclusive' when max_rolls was reached first.
+        """
+        alpha = 1 - confidence
+        k = 0
+        while True:
+            n = min(max(batch_size, self.num_rolls), max_rolls - self.num_rolls)
+            if n > 0:
+                self(count=n)
+            if not self.num_rolls:
+                return Certification('inconclusive', 0, math.nan, math.inf)
+
+            k += 1
+            statistic = self.ks_test().statistic
+            bound = math.sqrt(math.log(2 * k * (k + 1) / alpha) / (2 * self.num_rolls))
+            if statistic > bound:
+                return Certification('fail', self.num_rolls, statistic, bound)
+            if statistic + bound <= tolerance:
+                return Certification('pass', self.num_rolls, statistic, bound)
+            if self.num_rolls >= max_rolls:
+                return Certification('inconclusive', self.num_rolls, statistic, bound)
 
     def summary(self):
         return 'num_rolls={}, sum={}, theorectial_average={:3.2f}, average={:3.2f}, average_deviation={:3.2f}'.format(self.num_rolls, self.sum, self.theorectial_average, self.average, self.average_deviation)
@@ -109,16 +553,157 @@ class DieTester:
     def __str__(self):
         a = []
         a.append('die: ({})'.format(self.die))
-        a.append('num_rolls={}, sum={}, theorectial_average={:3.2f}, average={:3.2f}, average_deviation={:3.2f}'.format(self.num_rolls, self.sum, self.theorectial_average, self.average, self.average_deviation))
+        a.append(self.summary())
         if self.num_rolls:
             a.append('{: >4}, {: >4}, {: >5}, {}'.format('roll', 'num', '%', 'dev'))
-            a.extend(['{: 4}, {: 4}, {: 3.2f}, {}'.format(k, v, (v / self.num_rolls * 100), int(pow(self.exp-v, 2))) for (k, v) in self.rolls.items()])
+            a.extend(['{: 4}, {: 4}, {: 3.2f}, {}'.format(k, v, (v / self.num_rolls * 100), int(pow(self.num_rolls * p - v, 2))) for (k, v, p) in zip(range(self.minimum, self.die.sides + 1), self.rolls.tolist(), self.expected.tolist())])
         a.append('')
         return '\n'.join(a)
 
+class TestDieTester(unittest.TestCase):
+    def test_counts(self):
+        tester = DieTester(DiePerfect(sides=4, num_dice=2), batch_size=5)
+        tester(count=32)
+        self.assertEqual(tester.rolls.tolist(), [8, 8, 8, 8])
+        self.assertEqual(tester.num_rolls, 32)
+        self.assertEqual(tester.sum, 80)
+        self.assertEqual(tester.variance, tester.theoretical_variance)
+        self.assertFalse(tester.average_deviation)
+
+    def test_empty(self):
+        tester = DieTester(Die(sides=6))
+        self.assertEqual(tester.num_rolls, 0)
+        self.assertTrue(math.isnan(tester.average))
+
+    def test_d1000000(self):
+        tester = DieTester(Die(sides=1000000))
+        tester(count=1000000)
+        logging.info(tester.summary())
+        self.assertEqual(tester.rolls.sum(), tester.num_rolls)
+        self.assertTrue(tester.average_deviation / tester.theorectial_average < 0.01)
+
+class TestDieTesterStatistics(unittest.TestCase):
+    class DieLoaded(DieBase):
+        """ A d6 that turns one in ten 6s into a 1. """
+        def __init__(self, seed=None):
+            super(TestDieTesterStatistics.DieLoaded, self).__init__(sides=6, source=Die(sides=60, seed=seed))
+
+        def roll_batch(self, count=1):
+            rolls = self.source.roll_batch(count)
+            return np.where(rolls > 59, 1, (rolls + 9) // 10)
+
+    def test_perfect(self):
+        tester = DieTester(DiePerfect(sides=6, num_dice=2))
+        tester(count=72)
+        self.assertEqual(tester.chi_square(), (0, 1))
+        self.assertEqual(tester.g_test(), (0, 1))
+        self.assertEqual(tester.ks_test(), (0, 1))
+
+    def test_fair(self):
+        tester = DieTester(Die(sides=20, seed=1), lags=(1, 2))
+        tester(count=100000)
+        self.assertTrue(tester.chi_square().p_value > 0.001)
+        self.assertTrue(tester.g_test().p_value > 0.001)
+        self.assertTrue(tester.ks_test().p_value > 0.001)
+        self.assertTrue(tester.serial_correlation(lag=1).p_value > 0.001)
+        self.assertTrue(tester.serial_test(lag=2).p_value > 0.001)
+
+    def test_loaded(self):
+        tester = DieTester(TestDieTesterStatistics.DieLoaded(seed=1))
+        tester(count=50000)
+        self.assertTrue(tester.average_deviation < 0.25)
+        self.assertTrue(tester.chi_square().p_value < 1e-6)
+        self.assertTrue(tester.g_test().p_value < 1e-6)
+        self.assertTrue(tester.ks_test().p_value < 1e-6)
+
+    def test_serial(self):
+        # Every roll is uniform, but each one predicts the next.
+        tester = DieTester(DiePerfect(sides=6), batch_size=7, lags=(1, 6))
+        tester(count=600)
+        self.assertEqual(tester.chi_square().p_value, 1)
+        self.assertTrue(tester.serial_test(lag=1).p_value < 1e-6)
+        self.assertEqual(tester.pairs[6].trace(), 594)
+        self.assertAlmostEqual(tester.serial_correlation(lag=6).statistic, 1)
+
+    def test_serial_large(self):
+        # Too many sides for a histogram, the correlation still works.
+        tester = DieTester(Die(sides=pow(10, 6), seed=1), lags=(1,))
+        tester(count=100000)
+        self.assertIsNone(tester.pairs[1])
+        self.assertTrue(tester.serial_correlation().p_value > 0.001)
+        with self.assertRaises(Exception):
+            tester.serial_test()
+
+class TestDieTesterEmpty(unittest.TestCase):
+    def test_no_rolls(self):
+        tester = DieTester(Die(sides=6), lags=(1,))
+        for result in (tester.chi_square(), tester.g_test(), tester.ks_test(), tester.serial_correlation(), tester.serial_test()):
+            self.assertTrue(math.isnan(result.statistic))
+            self.assertTrue(math.isnan(result.p_value))
+
+class TestDieTesterCertify(unittest.TestCase):
+    def test_pass(self):
+        tester = DieTester(Die(sides=100, seed=1))
+        result = tester.certify(tolerance=0.02)
+        logging.info(result)
+        self.assertEqual(result.verdict, 'pass')
+        self.assertEqual(result.num_rolls, tester.num_rolls)
+        self.assertTrue(result.num_rolls < 100000)
+
+    def test_fail(self):
+        tester = DieTester(TestDieTesterStatistics.DieLoaded(seed=1))
+        result = tester.certify(tolerance=0.001)
+        logging.info(result)
+        self.assertEqual(result.verdict, 'fail')
+        self.assertTrue(result.statistic > result.bound)
+
+    def test_inconclusive(self):
+        tester = DieTester(Die(sides=6, seed=1))
+        result = tester.certify(tolerance=0.001, max_rolls=5000)
+        self.assertEqual(result.verdict, 'inconclusive')
+        self.assertEqual(result.num_rolls, 5000)
+
+    def test_no_rolls(self):
+        result = DieTester(Die(sides=6, seed=1)).certify(max_rolls=0)
+        self.assertEqual((result.verdict, result.num_rolls), ('inconclusive', 0))
+
 class Die(DieBase):
+    """ A die rolled with a numpy generator.
+
+    Scalar rolls are served from a buffer of buffer_size rolls, drawn in one
+    call, and roll_batch hands out what is left in the buffer first. numpy
+    gives the same rolls however they are split into calls, so both paths
+    give the same sequence.
+    """
+    def __init__(self, sides, seed=None, buffer_size=1024):
+        super(Die, self).__init__(sides=sides, source=None)
+        self.buffer_size = buffer_size
+        self.reseed(seed)
+
     def roll(self):
-        return random.randint(1, self.sides)
+        if self.cursor == len(self.buffer):
+            self.buffer = self.generator.integers(1, self.sides + 1, size=self.buffer_size, dtype=np.int64).tolist()
+            self.cursor = 0
+        self.num_outputs += 1
+        self.cursor += 1
+        return self.buffer[self.cursor - 1]
+
+    def roll_batch(self, count=1):
+        self.num_outputs += count
+        n = min(count, len(self.buffer) - self.cursor)
+        if not n:
+            return self.generator.integers(1, self.sides + 1, size=count, dtype=np.int64)
+
+        rolls = np.empty(count, dtype=np.int64)
+        rolls[:n] = self.buffer[self.cursor:self.cursor + n]
+        rolls[n:] = self.generator.integers(1, self.sides + 1, size=count - n, dtype=np.int64)
+        self.cursor += n
+        return rolls
+
+    def reseed(self, seed):
+        self.generator = np.random.default_rng(seed)
+        self.buffer = []
+        self.cursor = 0
 
 class TestDie(unittest.TestCase):
     def go(self, count, die, average_deviation=0.25):
@@ -127,6 +712,15 @@ class TestDie(unittest.TestCase):
         logging.info(tester.summary())
         self.assertTrue(tester.average_deviation < average_deviation)
 
+    def test_buffer(self):
+        # Scalar and batched rolls come from one sequence however they are mixed.
+        die = Die(sides=6, seed=1, buffer_size=8)
+        rolls = die(count=3) + die.roll_batch(count=2).tolist() + die(count=10) + die.roll_batch(count=20).tolist()
+        self.assertEqual(rolls, Die(sides=6, seed=1).roll_batch(count=35).tolist())
+        self.assertEqual(die.num_outputs, 35)
+        die.reseed(1)
+        self.assertEqual(die(count=3), rolls[:3])
+
     def test_1000d4(self):
         self.go(count=1000, die=Die(sides=4))
 
@@ -139,6 +733,958 @@ class TestDie(unittest.TestCase):
     def test_100000d100(self):
         self.go(count=100000, die=Die(sides=100))
 
+    def test_roll_batch(self):
+        rolls = Die(sides=6).roll_batch(count=1000)
+        self.assertEqual(rolls.dtype, np.int64)
+        self.assertEqual(len(rolls), 1000)
+        self.assertEqual(rolls.min(), 1)
+        self.assertEqual(rolls.max(), 6)
+
+    def test_seed(self):
+        self.assertEqual(list(Die(sides=20, seed=1).roll_batch(count=50)), list(Die(sides=20, seed=1).roll_batch(count=50)))
+
+class DieCounter(DieBase):
+    """ A die backed by the counter-based Philox generator.
+
+    Roll n is a pure function of the key and n, so skip(), seek() and at()
+    take constant time however far into the stream they go. Each 64 bit
+    output is scaled to the die with a multiply-shift, which is within
+    sides / 2**64 of uniform, instead of rejection sampling that would break
+    the fixed mapping from position to roll.
+    """
+    def __init__(self, sides, seed=None, position=0):
+        super(DieCounter, self).__init__(sides=sides, source=None)
+
+        if self.sides >= pow(2, 32):
+            raise Exception('Cannot make a counter die with {} sides.'.format(self.sides))
+
+        self._position = position
+        self.reseed(seed)
+
+    @property
+    def position(self):
+        return self._position
+
+    def reseed(self, seed):
+        hi, lo = seed_sequence(seed).generate_state(2, dtype=np.uint64)
+        self.key = (int(hi) << 64) | int(lo)
+        self.seek(self._position)
+
+    def seek(self, position):
+        self._position = position
+        self.bit_generator = self.generator(position)
+
+    def skip(self, n):
+        self.seek(self._position + n)
+
+    def generator(self, position):
+        """ Return a Philox bit generator whose next output is at position. """
+        block, lane = divmod(position, 4)
+        bit_generator = np.random.Philox(key=self.key, counter=block)
+        bit_generator.random_raw(lane)
+        return bit_generator
+
+    def scale(self, raw):
+        # floor(raw * sides / 2**64) computed in 32 bit halves to stay in uint64.
+        sides = np.uint64(self.sides)
+        low = (raw & np.uint64(0xffffffff)) * sides
+        high = (raw >> np.uint64(32)) * sides
+        return ((high + (low >> np.uint64(32))) >> np.uint64(32)).astype(np.int64) + 1
+
+    def at(self, index):
+        return int(self.scale(self.generator(index).random_raw(1))[0])
+
+    def roll(self):
+        return int(self.roll_batch(1)[0])
+
+    def roll_batch(self, count=1):
+        raw = self.bit_generator.random_raw(count)
+        self._position += count
+        self.num_outputs += count
+        return self.scale(raw)
+
+class TestDieCounter(unittest.TestCase):
+    def test_scale(self):
+        die = DieCounter(sides=3000000019, seed=1)
+        raw = die.generator(0).random_raw(1000)
+        self.assertEqual(die.scale(raw).tolist(), [(int(x) * die.sides >> 64) + 1 for x in raw])
+
+    def test_at(self):
+        die = DieCounter(sides=20, seed=1)
+        rolls = die(count=50)
+        self.assertEqual(rolls, [die.at(i) for i in range(0, 50)])
+        self.assertEqual(die.position, 50)
+
+    def test_skip(self):
+        die = DieCounter(sides=6, seed=1)
+        die.skip(pow(10, 12) - 3)
+        rolls = die.roll_batch(count=9).tolist()
+        self.assertEqual(rolls, [die.at(pow(10, 12) - 3 + i) for i in range(0, 9)])
+        die.seek(pow(10, 12) - 3)
+        self.assertEqual(die(count=9), rolls)
+
+    def test_seed(self):
+        self.assertEqual(DieCounter(sides=6, seed=1)(count=20), DieCounter(sides=6, seed=1)(count=20))
+        self.assertNotEqual(DieCounter(sides=6, seed=1)(count=20), DieCounter(sides=6, seed=2)(count=20))
+
+    def test_uniform(self):
+        tester = DieTester(DieCounter(sides=100, seed=1))
+        tester(count=100000)
+        self.assertTrue(tester.chi_square().p_value > 0.001)
+        self.assertTrue(tester.average_deviation < 0.25)
+
+class DieBits(DieBase):
+    """ A die that takes only the bits it needs from a pool of random bytes.
+
+    Bytes are drawn in bulk from os.urandom, or from a numpy generator when
+    seeded, and kept as a pool of 64 bit words. Each roll takes a word of
+    self.bits bits and scales it with Lemire's multiply-shift: the high part
+    of word * sides is the roll, and the word is rejected when the low part
+    falls below 2**bits % sides, which keeps the rolls exactly uniform.
+
+    Scalar rolls take whole 64 bit words from the pool and cut them up with
+    Python ints. The bits they have not used yet go back to the pool before
+    a batch, so both paths read the same bits in the same order.
+
+    By default the word size with the fewest expected bits per roll is
+    chosen. A power of two number of sides never rejects, so a DieBits with
+    256 sides is an ideal source for DieEntropy.
+    """
+    def __init__(self, sides, seed=None, precision=None, pool_size=4096):
+        super(DieBits, self).__init__(sides=sides, source=None)
+        self.pool_size = pool_size
+
+        least = max(1, (self.sides - 1).bit_length())
+        if precision is None:
+            self.bits = min(range(least, least + 9), key=lambda bits: bits / (1 - (pow(2, bits) % self.sides) / pow(2, bits)))
+        else:
+            self.bits = least + precision
+
+        if self.bits + self.sides.bit_length() > 64:
+            raise Exception('Cannot make a bit pool die with {} sides.'.format(self.sides))
+
+        self.threshold = pow(2, self.bits) % self.sides
+        self.num_bits = 0
+        self.reseed(seed)
+
+    def reseed(self, seed):
+        self.generator = np.random.default_rng(seed) if seed is not None else None
+        # The pool ends with a zero word, so a word can always be read together with the next one.
+        self.pool = np.zeros(1, dtype=np.uint64)
+        self.cursor = 0
+        self.spare = 0
+        self.num_spare = 0
+        self.spare_words = []
+
+    def refill(self, n):
+        """ Make sure at least n bits are left in the pool. """
+        if 64 * (len(self.pool) - 1) - self.cursor >= n:
+            return
+
+        size = 8 * max((self.pool_size + 7) // 8, (n + 63) // 64)
+        data = self.generator.bytes(size) if self.generator is not None else os.urandom(size)
+
+        # Keep the word before the cursor too, the scalar path may give back bits from it.
+        start = max(0, self.cursor // 64 - 1)
+        self.pool = np.concatenate([self.pool[start:-1], np.frombuffer(data, dtype='>u8').astype(np.uint64), np.zeros(1, dtype=np.uint64)])
+        self.cursor -= 64 * start
+
+    def take(self, n, bits):
+        """ Take n words of bits bits, at most 64, from the pool. """
+        self.refill(n * bits)
+        position = self.cursor + bits * np.arange(n, dtype=np.int64)
+        index = position >> 6
+        offset = (position & 63).astype(np.uint64)
+        # Shift in two steps, a shift by 64 is undefined.
+        low = (self.pool[index + 1] >> np.uint64(1)) >> (np.uint64(63) - offset)
+        self.cursor += n * bits
+        return ((self.pool[index] << offset) | low) >> np.uint64(64 - bits)
+
+    def give_back(self):
+        """ Return the bits held by the scalar path to the pool. """
+        self.cursor -= self.num_spare + 64 * len(self.spare_words)
+        self.spare = 0
+        self.num_spare = 0
+        self.spare_words = []
+
+    def words(self, n):
+        """ Take n words of self.bits bits from the pool. """
+        self.give_back()
+        return self.take(n, self.bits)
+
+    @property
+    def bits_consumed(self):
+        return float(self.num_bits)
+
+    @property
+    def bits_per_roll(self):
+        if not self.num_outputs:
+            return math.nan
+        return self.num_bits / self.num_outputs
+
+    def roll(self):
+        bits = self.bits
+        mask = (1 << bits) - 1
+        spare = self.spare
+        num_spare = self.num_spare
+        used = 0
+        while True:
+            if num_spare < bits:
+                if not self.spare_words:
+                    self.spare_words = self.take(64, 64).tolist()[::-1]
+                spare = (spare << 64) | self.spare_words.pop()
+                num_spare += 64
+
+            num_spare -= bits
+            m = (spare >> num_spare) * self._sides
+            spare &= (1 << num_spare) - 1
+            used += 1
+            if m & mask >= self.threshold:
+                break
+
+        self.spare = spare
+        self.num_spare = num_spare
+        self.num_iterations += 1
+        self.num_source_rolls += used
+        self.num_rejections += used - 1
+        self.num_bits += used * bits
+        self.num_outputs += 1
+        return (m >> bits) + 1
+
+    def roll_batch(self, count=1):
+        results = [np.empty(0, dtype=np.int64)]
+        accept = 1 - self.threshold / pow(2, self.bits)
+        while count > 0:
+            n = int(count / accept) + 1
+            m = self.words(n) * np.uint64(self.sides)
+            accepted = (m & np.uint64(pow(2, self.bits) - 1)) >= np.uint64(self.threshold)
+
+            # Give back the words after the last roll that is needed.
+            used = n
+            if accepted.sum() > count:
+                used = int(np.flatnonzero(accepted)[count - 1]) + 1
+                self.cursor -= (n - used) * self.bits
+                m = m[:used]
+                accepted = accepted[:used]
+
+            v = (m[accepted] >> np.uint64(self.bits)).astype(np.int64) + 1
+            self.num_iterations += 1
+            self.num_source_rolls += used
+            self.num_rejections += used - len(v)
+            self.num_bits += used * self.bits
+            self.num_outputs += len(v)
+
+            results.append(v)
+            count -= len(v)
+
+        return np.concatenate(results)
+
+    def __str__(self):
+        return '{}, bits={}'.format(super(DieBits, self).__str__(), self.bits)
+
+class TestDieBits(unittest.TestCase):
+    def test_uniform(self):
+        tester = DieTester(DieBits(sides=45, seed=1))
+        tester(count=100000)
+        logging.info(tester.summary())
+        self.assertTrue(tester.chi_square().p_value > 0.001)
+        self.assertTrue(tester.average_deviation < 0.25)
+
+    def test_scalar(self):
+        die = DieBits(sides=6, seed=1)
+        rolls = die(count=10) + die.roll_batch(count=1000).tolist() + die(count=10)
+        die.reseed(1)
+        self.assertEqual(die.roll_batch(count=1020).tolist(), rolls)
+
+    def test_refill(self):
+        # Words of 21 bits cross the 64 bit words, and the small pool refills often.
+        die = DieBits(sides=pow(10, 6) + 3, seed=1, pool_size=16)
+        rolls = []
+        for i in range(0, 50):
+            rolls += die(count=i % 7) + die.roll_batch(count=i % 5).tolist()
+        other = DieBits(sides=pow(10, 6) + 3, seed=1, pool_size=16)
+        self.assertEqual(other.roll_batch(count=len(rolls)).tolist(), rolls)
+        self.assertEqual(die.num_bits, other.num_bits)
+
+    def test_lemire(self):
+        die = DieBits(sides=6, seed=1, precision=2)
+        words = [int(w) for w in DieBits(sides=6, seed=1, precision=2).words(100)]
+        expected = [(w * 6 >> die.bits) + 1 for w in words if (w * 6) % pow(2, die.bits) >= pow(2, die.bits) % 6]
+        self.assertEqual(die.roll_batch(count=len(expected)).tolist(), expected)
+        self.assertEqual(die.num_source_rolls, 100)
+
+    def test_efficiency(self):
+        die = DieBits(sides=6, seed=1)
+        die.roll_batch(count=100000)
+        self.assertEqual(die.bits, 3)
+        self.assertAlmostEqual(die.bits_per_roll, 4, places=1)
+
+        die = DieBits(sides=256)
+        die.roll_batch(count=1000)
+        self.assertEqual(die.num_rejections, 0)
+        self.assertEqual(die.efficiency, 1)
+
+    def test_entropy(self):
+        source = DieBits(sides=256, seed=1)
+        die = DieEntropy(sides=6, source=source)
+        die(count=10000)
+        self.assertTrue(die.efficiency * source.efficiency > 0.99)
+
+class DieRecorded(DieBase):
+    """ A die that replays recorded rolls from a packed binary file.
+
+    The file holds one unsigned integer of the given dtype per roll, from 1
+    to sides. It is memory-mapped, and rolls are read as numpy views of the
+    mapping without copying the file. A reader can be limited to the rolls
+    from start to stop so several readers can share one file, each mapping
+    only its own part, and its position can be saved to cursor_path and
+    picked up again later.
+
+    close(), or using the die as a context manager, unmaps the file. The
+    views returned by read() have to be released first.
+    """
+    def __init__(self, path, sides, dtype=np.uint8, start=0, stop=None, cursor_path=None):
+        super(DieRecorded, self).__init__(sides=sides, source=None)
+        self.path = path
+        self.cursor_path = cursor_path
+        self.closed = False
+
+        itemsize = np.dtype(dtype).itemsize
+        with open(path, 'rb') as f:
+            rolls = range(0, os.fstat(f.fileno()).st_size // itemsize)[start:stop]
+            self.start = rolls.start
+
+            # An empty file cannot be mapped, and a mapping has to start on an allocation boundary.
+            self.mmap = None
+            self.data = np.empty(0, dtype=dtype)
+            if len(rolls):
+                begin = rolls.start * itemsize
+                offset = begin - begin % mmap.ALLOCATIONGRANULARITY
+                self.mmap = mmap.mmap(f.fileno(), begin + len(rolls) * itemsize - offset, access=mmap.ACCESS_READ, offset=offset)
+                self.data = np.frombuffer(self.mmap, dtype=dtype, count=len(rolls), offset=begin - offset)
+
+        self._position = 0
+        if cursor_path is not None and os.path.exists(cursor_path):
+            with open(cursor_path) as f:
+                self.seek(int(f.read()))
+
+    @staticmethod
+    def write(path, rolls, dtype=np.uint8):
+        """ Write rolls to a file that DieRecorded can read. """
+        with open(path, 'wb') as f:
+            f.write(np.asarray(rolls).astype(dtype).tobytes())
+
+    @staticmethod
+    def write_stream(path, chunks, dtype=np.uint8):
+        """ Write every batch of rolls from an iterable and return the number of rolls. """
+        count = 0
+        with open(path, 'wb') as f:
+            for rolls in chunks:
+                f.write(np.asarray(rolls).astype(dtype).tobytes())
+                count += len(rolls)
+        return count
+
+    @staticmethod
+    def split(path, sides, parts, dtype=np.uint8):
+        """ Return parts readers over disjoint slices of one file. """
+        size = os.path.getsize(path) // np.dtype(dtype).itemsize
+        bounds = [size * i // parts for i in range(0, parts + 1)]
+        return [DieRecorded(path, sides, dtype=dtype, start=bounds[i], stop=bounds[i + 1]) for i in range(0, parts)]
+
+    @property
+    def position(self):
+        return self._position
+
+    @property
+    def remaining(self):
+        return len(self.data) - self._position
+
+    def seek(self, position):
+        if not 0 <= position <= len(self.data):
+            raise ValueError('Position {} is outside the {} rolls of {} from {}.'.format(position, len(self.data), self.path, self.start))
+        self._position = position
+
+    def close(self):
+        """ Unmap the file. """
+        if self.mmap is not None:
+            self.data = self.data[:0].copy()
+            self.mmap.close()
+            self.mmap = None
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def save(self):
+        """ Write the position to cursor_path so a new reader can carry on from it. """
+        temp = self.cursor_path + '.tmp'
+        with open(temp, 'w') as f:
+            f.write(str(self._position))
+        os.replace(temp, self.cursor_path)
+
+    def read(self, count):
+        """ Return the next count rolls as a read-only view of the file. """
+        if self.closed:
+            raise ValueError('Read from {} after it was closed.'.format(self.path))
+        if count > self.remaining:
+            raise EOFError('Only {} of {} requested rolls left in {} at position {}.'.format(self.remaining, count, self.path, self.start + self._position))
+
+        rolls = self.data[self._position:self._position + count]
+        if len(rolls) and (rolls.min() < 1 or rolls.max() > self.sides):
+            raise ValueError('Rolls out of range for {} sides in {} after position {}.'.format(self.sides, self.path, self.start + self._position))
+
+        self._position += count
+        self.num_outputs += count
+        return rolls
+
+    def roll(self):
+        return int(self.read(1)[0])
+
+    def roll_batch(self, count=1):
+        return self.read(count).astype(np.int64)
+
+    def __str__(self):
+        return '{}, path={}, position={}'.format(super(DieRecorded, self).__str__(), self.path, self.start + self._position)
+
+class TestDieRecorded(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'rolls.bin')
+        self.rolls = Die(sides=6, seed=1).roll_batch(count=1000)
+        DieRecorded.write(self.path, self.rolls)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_replay(self):
+        die = DieRecorded(self.path, sides=6)
+        self.assertEqual(die(count=10) + die.roll_batch(count=990).tolist(), self.rolls.tolist())
+        self.assertEqual(die.remaining, 0)
+
+    def test_exhausted(self):
+        die = DieRecorded(self.path, sides=6)
+        die.roll_batch(count=999)
+        with self.assertRaises(EOFError):
+            die.roll_batch(count=2)
+        self.assertEqual(die.roll(), self.rolls[-1])
+        with self.assertRaises(EOFError):
+            die.roll()
+
+    def test_cursor(self):
+        cursor = os.path.join(self.dir.name, 'rolls.cursor')
+        die = DieRecorded(self.path, sides=6, cursor_path=cursor)
+        die.roll_batch(count=300)
+        die.save()
+        die = DieRecorded(self.path, sides=6, cursor_path=cursor)
+        self.assertEqual(die.position, 300)
+        self.assertEqual(die.roll_batch(count=10).tolist(), self.rolls[300:310].tolist())
+
+    def test_bad_cursor(self):
+        # A position saved by a reader of a bigger slice does not fit this one.
+        cursor = os.path.join(self.dir.name, 'rolls.cursor')
+        die = DieRecorded(self.path, sides=6, cursor_path=cursor)
+        die.roll_batch(count=600)
+        die.save()
+        with self.assertRaises(ValueError):
+            DieRecorded(self.path, sides=6, start=500, cursor_path=cursor)
+        with self.assertRaises(ValueError):
+            die.seek(-1)
+
+    def test_split(self):
+        readers = DieRecorded.split(self.path, sides=6, parts=3)
+        self.assertEqual([r.remaining for r in readers], [333, 333, 334])
+        self.assertEqual(np.concatenate([r.roll_batch(r.remaining) for r in readers]).tolist(), self.rolls.tolist())
+        for r in readers:
+            r.close()
+
+    def test_split_large(self):
+        # Slices that start past an allocation boundary of the mapping.
+        rolls = Die(sides=6, seed=2).roll_batch(count=3 * mmap.ALLOCATIONGRANULARITY + 5)
+        DieRecorded.write(self.path, rolls, dtype=np.uint16)
+        readers = DieRecorded.split(self.path, sides=6, parts=4, dtype=np.uint16)
+        self.assertEqual(np.concatenate([r.roll_batch(r.remaining) for r in readers]).tolist(), rolls.tolist())
+        self.assertTrue(all(len(r.mmap) < len(rolls) for r in readers))
+
+    def test_close(self):
+        with DieRecorded(self.path, sides=6) as die:
+            self.assertEqual(die(count=3), self.rolls[:3].tolist())
+        self.assertIsNone(die.mmap)
+        with self.assertRaises(ValueError):
+            die.roll()
+
+    def test_empty(self):
+        DieRecorded.write(self.path, [])
+        die = DieRecorded(self.path, sides=6)
+        self.assertEqual(die.remaining, 0)
+        self.assertEqual(len(die.roll_batch(count=0)), 0)
+        with self.assertRaises(EOFError):
+            die.roll()
+
+    def test_source(self):
+        die = DieCombo(sides=45, source=DieRecorded(self.path, sides=6))
+        self.assertEqual(die.roll_batch(count=100).tolist(), DieCombo(sides=45, source=DieRecorded(self.path, sides=6))(count=100))
+
+    def test_write_stream(self):
+        die = DieCombo(sides=45, source=Die(sides=10, seed=2))
+        self.assertEqual(DieRecorded.write_stream(self.path, die.stream(chunk_size=100, count=1050)), 1050)
+        rolls = DieRecorded(self.path, sides=45).roll_batch(count=1050)
+        self.assertEqual(rolls.tolist(), DieCombo(sides=45, source=Die(sides=10, seed=2)).roll_batch(count=1050).tolist())
+
+    def test_out_of_range(self):
+        DieRecorded.write(self.path, [1, 2, 7])
+        with self.assertRaises(ValueError):
+            DieRecorded(self.path, sides=6).roll_batch(count=3)
+
+class RollWriter:
+    """ Write rolls to a compact packed file that RollReader can read.
+
+    Rolls are packed rolls_per_word at a time into 64 bit words as mixed-radix
+    numbers, the first roll being the least significant digit. A d6 takes 24
+    rolls per word, 2.67 bits a roll. The header holds the sides, the count,
+    the packing and a JSON provenance, such as the seed and die used. Every
+    word holds the same number of rolls, so any roll can be found without
+    reading the ones before it.
+    """
+    MAGIC = b'DICEROLL'
+    HEADER = struct.Struct('<8sHIQQI')
+    VERSION = 1
+
+    def __init__(self, path, sides, provenance=None):
+        self.sides = sides
+        self.rolls_per_word = RollWriter.rolls_per_word(sides)
+        self.count = 0
+        self.pending = np.empty(0, dtype=np.uint64)
+        self.powers = np.array([pow(sides, k) for k in range(0, self.rolls_per_word)], dtype=np.uint64)
+
+        provenance = json.dumps(provenance or {}).encode()
+        self.header_size = RollWriter.HEADER.size + len(provenance)
+        # Words start on an 8 byte boundary.
+        self.header_size += -self.header_size % 8
+
+        self.file = open(path, 'wb')
+        self.write_header()
+        self.file.write(provenance)
+        self.file.write(bytes(self.header_size - RollWriter.HEADER.size - len(provenance)))
+
+    @staticmethod
+    def rolls_per_word(sides):
+        if sides < 2 or sides >= pow(2, 64):
+            # A die with one side has nothing to record, and the header holds the sides in 64 bits.
+            raise ValueError('Cannot pack rolls of a die with {} sides.'.format(sides))
+        k = 1
+        while pow(sides, k + 1) <= pow(2, 64):
+            k += 1
+        return k
+
+    def write_header(self):
+        self.file.write(RollWriter.HEADER.pack(RollWriter.MAGIC, RollWriter.VERSION, self.header_size, self.sides, self.count, self.rolls_per_word))
+
+    def write(self, rolls):
+        rolls = np.asarray(rolls)
+        if len(rolls) and (rolls.min() < 1 or rolls.max() > self.sides):
+            # Out of range rolls would spill into the digits next to them.
+            raise ValueError('Rolls out of range for {} sides after roll {}.'.format(self.sides, self.count + len(self.pending)))
+
+        rolls = np.concatenate([self.pending, rolls.astype(np.uint64) - np.uint64(1)])
+        n = len(rolls) // self.rolls_per_word * self.rolls_per_word
+        words = rolls[:n].reshape(-1, self.rolls_per_word) @ self.powers
+        self.file.write(words.astype('<u8').tobytes())
+        self.pending = rolls[n:]
+        self.count += n
+
+    def close(self):
+        if len(self.pending):
+            self.count += len(self.pending)
+            words = np.zeros(self.rolls_per_word, dtype=np.uint64)
+            words[:len(self.pending)] = self.pending
+            self.file.write(np.array([words @ self.powers], dtype='<u8').tobytes())
+            self.pending = self.pending[:0]
+
+        self.file.seek(0)
+        self.write_header()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class RollReader:
+    """ Read rolls written by RollWriter, from any position. """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, header_size, self.sides, self.count, self.rolls_per_word) = RollWriter.HEADER.unpack_from(self.mmap)
+        if magic != RollWriter.MAGIC or version != RollWriter.VERSION:
+            raise ValueError('{} is not a packed roll file.'.format(path))
+
+        provenance = bytes(self.mmap[RollWriter.HEADER.size:header_size]).rstrip(b'\0')
+        self.provenance = json.loads(provenance)
+        self.words = np.frombuffer(self.mmap, dtype='<u8', offset=header_size)
+
+    def __len__(self):
+        return self.count
+
+    def read(self, start=0, count=None):
+        """ Return count rolls from start as an int64 array. """
+        if count is None:
+            count = self.count - start
+        if start < 0 or start + count > self.count:
+            raise EOFError('Rolls {} to {} are not in {} which has {}.'.format(start, start + count, self.path, self.count))
+
+        first = start // self.rolls_per_word
+        last = (start + count + self.rolls_per_word - 1) // self.rolls_per_word
+        words = self.words[first:last].astype(np.uint64)
+
+        rolls = np.empty((len(words), self.rolls_per_word), dtype=np.int64)
+        sides = np.uint64(self.sides)
+        for k in range(0, self.rolls_per_word):
+            rolls[:, k] = words % sides
+            words = words // sides
+
+        offset = start - first * self.rolls_per_word
+        return rolls.reshape(-1)[offset:offset + count] + 1
+
+    def stream(self, chunk_size=65536):
+        for start in range(0, self.count, chunk_size):
+            yield self.read(start, min(chunk_size, self.count - start))
+
+def write_rolls(path, die, count, chunk_size=65536, provenance=None):
+    """ Roll die count times straight into a packed file. """
+    provenance = dict(provenance or {}, die=str(die), count=count)
+    with RollWriter(path, die.sides, provenance=provenance) as writer:
+        for rolls in die.stream(chunk_size=chunk_size, count=count):
+            writer.write(rolls)
+
+class TestRollFile(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'rolls.dice')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_rolls_per_word(self):
+        self.assertEqual(RollWriter.rolls_per_word(2), 64)
+        self.assertEqual(RollWriter.rolls_per_word(6), 24)
+        self.assertEqual(RollWriter.rolls_per_word(256), 8)
+        self.assertEqual(RollWriter.rolls_per_word(pow(2, 64) - 1), 1)
+        for sides in (1, pow(2, 64)):
+            with self.assertRaises(ValueError):
+                RollWriter.rolls_per_word(sides)
+        with self.assertRaises(ValueError):
+            RollWriter(self.path, sides=1)
+
+    def test_out_of_range(self):
+        with RollWriter(self.path, sides=6) as writer:
+            writer.write([1, 2])
+            for rolls in ([7, 1, 1], [0, 1, 1]):
+                with self.assertRaises(ValueError):
+                    writer.write(rolls)
+            writer.write([3])
+        self.assertEqual(RollReader(self.path).read(0, 3).tolist(), [1, 2, 3])
+
+    def test_round_trip(self):
+        for sides in (2, 6, 45, 256, 4000, pow(2, 32) - 5):
+            rolls = Die(sides=sides, seed=sides).roll_batch(count=1001)
+            with RollWriter(self.path, sides, provenance={'seed': sides}) as writer:
+                writer.write(rolls[:7])
+                writer.write(rolls[7:500])
+                writer.write(rolls[500:])
+            reader = RollReader(self.path)
+            self.assertEqual((reader.sides, len(reader), reader.provenance), (sides, 1001, {'seed': sides}))
+            self.assertEqual(reader.read().tolist(), rolls.tolist())
+            self.assertEqual(reader.read(start=333, count=100).tolist(), rolls[333:433].tolist())
+
+    def test_size(self):
+        write_rolls(self.path, Die(sides=6, seed=1), count=240000, provenance={'seed': 1})
+        self.assertTrue(os.path.getsize(self.path) < 240000 * 3 / 8 + 256)
+        reader = RollReader(self.path)
+        self.assertEqual(reader.provenance['seed'], 1)
+        self.assertEqual(np.concatenate(list(reader.stream(chunk_size=50000))).tolist(), Die(sides=6, seed=1).roll_batch(count=240000).tolist())
+
+    def test_errors(self):
+        write_rolls(self.path, DiePerfect(sides=6), count=10)
+        with self.assertRaises(EOFError):
+            RollReader(self.path).read(start=5, count=6)
+        with open(self.path, 'r+b') as f:
+            f.write(b'X')
+        with self.assertRaises(ValueError):
+            RollReader(self.path)
+
+class DiePrefetch(DieBase):
+    """ Roll a source die ahead of time on a background thread.
+
+    The thread keeps a buffer of rolls from the source. Once the buffer holds
+    high rolls it waits until it has drained to low, then fills it up to high
+    again in chunks of chunk_size, so roll() is usually just taking rolls from
+    the buffer. There is one producer, so the rolls come out in exactly the
+    order the source would give them.
+
+    A roll that finds the buffer empty has to wait, which is counted in
+    num_stalls and stall_time. An error from the source is raised when a
+    call asks for more rolls than were made before it. The rolls that call
+    had already taken stay in the buffer for the next one.
+    """
+    def __init__(self, source, high=65536, low=None, chunk_size=4096):
+        super(DiePrefetch, self).__init__(sides=source.sides, source=source)
+        self.high = high
+        self.low = high // 4 if low is None else low
+        self.chunk_size = chunk_size
+
+        self.chunks = deque()
+        self.offset = 0
+        self.occupancy = 0
+        self.error = None
+        self.stopped = False
+        self.num_stalls = 0
+        self.stall_time = 0.0
+
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.produce, daemon=True)
+        self.thread.start()
+
+    def produce(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.stopped or self.occupancy <= self.low)
+                if self.stopped:
+                    return
+
+            while self.occupancy < self.high and not self.stopped:
+                n = min(self.chunk_size, self.high - self.occupancy)
+
+                # A recorded source may have fewer rolls left than a chunk.
+                remaining = getattr(self.source, 'remaining', None)
+                if remaining:
+                    n = min(n, remaining)
+                try:
+                    rolls = self.source.roll_batch(n)
+                except Exception as e:
+                    with self.condition:
+                        self.error = e
+                        self.condition.notify_all()
+                    return
+
+                with self.condition:
+                    self.chunks.append(rolls)
+                    self.occupancy += len(rolls)
+                    self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def roll(self):
+        return int(self.roll_batch(1)[0])
+
+    def roll_batch(self, count=1):
+        results = [np.empty(0, dtype=np.int64)]
+        with self.condition:
+            while count > 0:
+                if not self.occupancy:
+                    if self.error is not None or self.stopped:
+                        # Put back what was taken, so it can still be used.
+                        taken = np.concatenate(results)
+                        if len(taken):
+                            self.chunks.appendleft(taken)
+                            self.occupancy += len(taken)
+                        if self.error is not None:
+                            raise self.error
+                        raise Exception('Prefetch die is closed.')
+
+                    self.num_stalls += 1
+                    start = time.monotonic()
+                    self.condition.notify_all()
+                    self.condition.wait_for(lambda: self.occupancy or self.error is not None or self.stopped)
+                    self.stall_time += time.monotonic() - start
+                    continue
+
+                chunk = self.chunks[0]
+                n = min(count, len(chunk) - self.offset)
+                results.append(chunk[self.offset:self.offset + n])
+                self.offset += n
+                self.occupancy -= n
+                count -= n
+                if self.offset == len(chunk):
+                    self.chunks.popleft()
+                    self.offset = 0
+
+            if self.occupancy <= self.low:
+                self.condition.notify_all()
+
+            rolls = np.concatenate(results)
+            self.num_outputs += len(rolls)
+            self.num_source_rolls += len(rolls)
+        return rolls
+
+    def stats(self):
+        stats = super(DiePrefetch, self).stats()
+        stats.update({
+            'occupancy': self.occupancy,
+            'stalls': self.num_stalls,
+            'stall_time': self.stall_time,
+        })
+        return stats
+
+    def __str__(self):
+        return '{}, high={}, low={}'.format(super(DiePrefetch, self).__str__(), self.high, self.low)
+
+class TestDiePrefetch(unittest.TestCase):
+    def test_sequence(self):
+        with DiePrefetch(DieCombo(sides=45, source=Die(sides=10, seed=1)), high=1000, chunk_size=300) as die:
+            rolls = die(count=10) + die.roll_batch(count=5000).tolist() + die(count=10)
+        self.assertEqual(rolls, DieCombo(sides=45, source=Die(sides=10, seed=1)).roll_batch(count=5020).tolist())
+
+    def test_watermarks(self):
+        source = DiePerfect(sides=6)
+        with DiePrefetch(source, high=100, low=20, chunk_size=30) as die:
+            with die.condition:
+                die.condition.wait_for(lambda: die.occupancy == 100)
+            self.assertEqual(source.num_rolls, 100)
+
+            # Nothing more is made until the buffer drains to low.
+            die.roll_batch(count=70)
+            time.sleep(0.05)
+            self.assertEqual(source.num_rolls, 100)
+            self.assertEqual(die.stats()['occupancy'], 30)
+
+            die.roll_batch(count=10)
+            with die.condition:
+                die.condition.wait_for(lambda: die.occupancy == 100)
+            self.assertEqual(source.num_rolls, 180)
+
+    def test_stall(self):
+        with DiePrefetch(Die(sides=6, seed=1), high=10, chunk_size=10) as die:
+            die.roll_batch(count=1000)
+            self.assertTrue(die.num_stalls > 0)
+            self.assertEqual(die.num_outputs, 1000)
+
+    def test_error(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'rolls.bin')
+            DieRecorded.write(path, DiePerfect(sides=6).roll_batch(count=25))
+            with DiePrefetch(DieRecorded(path, sides=6), high=10, chunk_size=10) as die:
+                self.assertEqual(len(die.roll_batch(count=20)), 20)
+                with self.assertRaises(EOFError):
+                    die.roll_batch(count=10)
+                self.assertEqual(die.num_outputs, 20)
+
+                # The last rolls of the recording can still be read.
+                self.assertEqual(die.roll_batch(count=5).tolist(), [3, 4, 5, 6, 1])
+                self.assertEqual(die.num_outputs, 25)
+                with self.assertRaises(EOFError):
+                    die.roll()
+
+def roll_chunk(die, seed, count):
+    die.reseed(seed)
+    return die.roll_batch(count)
+
+def check_parallel(die):
+    """ Raise an Exception unless die can be copied to a worker and reseeded there.
+
+    Every die at the bottom of the chain has to take a seed, or each chunk
+    would get the same rolls from it.
+    """
+    dice = [die]
+    while dice:
+        d = dice.pop()
+        if not d.sources() and type(d).reseed is DieBase.reseed:
+            raise Exception('Cannot roll {} in parallel, {} cannot be reseeded.'.format(type(die).__name__, type(d).__name__))
+        dice.extend(d.sources())
+
+    try:
+        pickle.dumps(die)
+    except (TypeError, pickle.PicklingError) as e:
+        raise Exception('Cannot roll {} in parallel, it cannot be copied to a worker: {}'.format(type(die).__name__, e))
+
+def roll_parallel(die, count, seed=None, workers=None, chunk_size=1048576):
+    """ Roll count times, sharding the work across a pool of processes.
+
+    The rolls are split into chunks of chunk_size. Each chunk is rolled by a
+    copy of die whose random dice are reseeded from its own child of one root
+    SeedSequence, and the chunks are returned in order. The result therefore
+    only depends on seed and chunk_size, not on the number of workers.
+    Dice that cannot be reseeded, such as DiePerfect or DieRecorded, or
+    copied, such as DiePrefetch, are refused, see check_parallel.
+    """
+    check_parallel(die)
+    children = np.random.SeedSequence(seed).spawn((count + chunk_size - 1) // chunk_size)
+    counts = [min(chunk_size, count - i * chunk_size) for i in range(0, len(children))]
+    if not counts:
+        return np.empty(0, dtype=np.int64)
+
+    if workers == 1:
+        chunks = [roll_chunk(copy.deepcopy(die), child, n) for (child, n) in zip(children, counts)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks = list(pool.map(roll_chunk, [die] * len(counts), children, counts))
+
+    return np.concatenate(chunks)
+
+class TestRollParallel(unittest.TestCase):
+    def test_reproducible(self):
+        die = DieCombo(sides=45, source=Die(sides=10))
+        rolls = roll_parallel(die, count=10000, seed=42, workers=1, chunk_size=1000)
+        self.assertEqual(len(rolls), 10000)
+        self.assertEqual(rolls.tolist(), roll_parallel(die, count=10000, seed=42, workers=3, chunk_size=1000).tolist())
+
+    def test_independent(self):
+        rolls = roll_parallel(Die(sides=1000), count=4000, seed=1, workers=1, chunk_size=1000).reshape(4, 1000)
+        self.assertEqual(len(set(tuple(chunk) for chunk in rolls.tolist())), 4)
+        self.assertNotEqual(rolls.tolist(), roll_parallel(Die(sides=1000), count=4000, seed=2, workers=1, chunk_size=1000).tolist())
+
+    def test_partial_chunk(self):
+        tester = DieTester(Die(sides=6))
+        tester.update(roll_parallel(tester.die, count=2500, seed=1, workers=2, chunk_size=1000))
+        self.assertEqual(tester.num_rolls, 2500)
+        self.assertTrue(tester.average_deviation < 0.25)
+
+    def test_empty(self):
+        self.assertEqual(len(roll_parallel(Die(sides=6), count=0)), 0)
+
+    def test_counter(self):
+        die = DieCombo(sides=45, source=DieCounter(sides=10, seed=1))
+        rolls = roll_parallel(die, count=10, seed=1, workers=1, chunk_size=5)
+        self.assertEqual(rolls.tolist(), roll_parallel(die, count=10, seed=1, workers=2, chunk_size=5).tolist())
+        self.assertNotEqual(rolls[:5].tolist(), rolls[5:].tolist())
+
+    def test_refused(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rolls.bin')
+            DieRecorded.write(path, [1, 2, 3, 4, 5, 6] * 10)
+            with DieRecorded(path, sides=6) as recorded:
+                for die in (DiePerfect(sides=6), DieCombo(sides=45, source=recorded), DieMulti(sides=30, sources=[Die(sides=6), DiePerfect(sides=10)])):
+                    with self.assertRaises(Exception):
+                        roll_parallel(die, count=10, seed=1, workers=1, chunk_size=5)
+
+        prefetch = DiePrefetch(Die(sides=6, seed=1))
+        try:
+            with self.assertRaises(Exception) as cm:
+                roll_parallel(prefetch, count=10, seed=1, chunk_size=5)
+            self.assertTrue(str(cm.exception).startswith('Cannot roll DiePrefetch in parallel'))
+        finally:
+            prefetch.close()
+
+    def test_spawning_dice(self):
+        # Dice that spawn seeds for their own sources are reseeded with a SeedSequence.
+        die = DieMulti(sides=30, sources=[Die(sides=6), DieCounter(sides=10)])
+        self.assertEqual(len(roll_parallel(die, count=10, seed=1, workers=1, chunk_size=5)), 10)
+
 class DieDivider(DieBase):
     def __init__(self, sides, source):
         super(DieDivider, self).__init__(sides=sides, source=source)
@@ -147,9 +1693,29 @@ class DieDivider(DieBase):
             raise Exception('Cannot divide a die from {} sides, to {} sides.'.format(source.sides, sides))
 
         self.divisor = self.source.sides // self.sides
+        self.num_dice = 1
+
+    def check(self, max_table=MAX_TABLE):
+        return check_converter(self, self.divisor, max_table)
+
+    def stage(self):
+        def build():
+            return ((np.arange(1, self.source.sides + 1, dtype=np.int64) + self.divisor - 1) // self.divisor).astype(table_dtype(self.sides))
+
+        table = table_cache.get((DieDivider, self.source.sides, 1, self.sides), self.source.sides, build)
+        return Stage(self.sides, self.source.sides, np.ones(1, dtype=np.int64), table)
 
     def roll(self):
-        return math.ceil(self.source.roll() / self.divisor)
+        self.num_outputs += 1
+        self.num_source_rolls += 1
+        self.num_iterations += 1
+        return (self.source.roll() + self.divisor - 1) // self.divisor
+
+    def roll_batch(self, count=1):
+        self.num_outputs += count
+        self.num_source_rolls += count
+        self.num_iterations += 1
+        return (self.source.roll_batch(count) + self.divisor - 1) // self.divisor
 
 class TestDieDivider(unittest.TestCase):
     def go(self, die):
@@ -170,28 +1736,188 @@ class TestDieDivider(unittest.TestCase):
     def test_d9_from_d18(self):
         self.go(die=DieDivider(sides=9, source=DiePerfect(sides=18)))
 
-class DiePower(DieBase):
-    def __init__(self, sides, source):
-        super(DiePower, self).__init__(sides=sides, source=source)
+    def test_roll_batch(self):
+        die = DieDivider(sides=4, source=DiePerfect(sides=12))
+        self.assertEqual(list(die.roll_batch(count=12)), die(count=12))
+
+Stage = namedtuple('Stage', ['sides', 'source_sides', 'weights', 'table'])
+Stage.__doc__ = """ A converter as a lookup table.
+
+Each output takes len(weights) source rolls. The rolls are combined into an
+index with sum(weights * (rolls - 1)), and table[index] is the roll, or 0 to
+reject the rolls and try again.
+"""
+
+class TableCache:
+    """ A process-wide LRU cache of converter lookup tables.
+
+    Tables are keyed by (class, source sides, num_dice, sides) so every die
+    with the same configuration shares one read-only table. The cache holds
+    at most max_entries table entries in total. Converters only ask for
+    tables of up to max_table entries, by default a sixteenth of the total,
+    and a table bigger than that is built for the caller but not kept.
+    """
+    def __init__(self, max_entries=16777216, max_table=None):
+        self.max_entries = max_entries
+        self.max_table = max_entries // 16 if max_table is None else max_table
+        self.num_entries = 0
+        self.hits = 0
+        self.misses = 0
+        self.tables = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, size, build):
+        with self.lock:
+            table = self.tables.get(key)
+            if table is not None:
+                self.tables.move_to_end(key)
+                self.hits += 1
+                return table
+            self.misses += 1
+
+        table = build()
+        table.flags.writeable = False
+        if size > self.max_table:
+            return table
+
+        with self.lock:
+            if key not in self.tables:
+                self.tables[key] = table
+                self.num_entries += size
+            while self.num_entries > self.max_entries:
+                (k, t) = self.tables.popitem(last=False)
+                self.num_entries -= len(t)
+
+        return table
+
+    def clear(self):
+        with self.lock:
+            self.tables.clear()
+            self.num_entries = 0
+
+table_cache = TableCache()
+
+def table_dtype(sides):
+    """ The smallest unsigned integer type that holds rolls from 0 to sides. """
+    return np.min_scalar_type(sides)
+
+@functools.lru_cache(maxsize=4096)
+def min_num_dice(source_sides, sides):
+    """ Return the minimum number of source dice that can cover sides. """
+    num_dice = 0
+    while pow(source_sides, num_dice) < sides:
+        num_dice += 1
+    return num_dice
+
+def roll_batch_digits(die, count, weights, divider=1, table=None):
+    """ Batched rejection sampling shared by DiePower and DieCombo.
+
+    Draws a (count, num_dice) matrix of source rolls, combines each row with
+    the radix weights and keeps the rows that land within the die, either by
+    looking them up in table or with arithmetic. Only the missing outputs are
+    re-drawn, so the source is consumed in exactly the same order as repeated
+    calls to roll().
+    """
+    if table is None and pow(die.source.sides, len(weights)) > np.iinfo(np.int64).max:
+        return DieBase.roll_batch(die, count)
+
+    weights = np.array(weights, dtype=np.int64)
+    results = [np.empty(0, dtype=np.int64)]
+    while count > 0:
+        rolls = die.source.roll_batch(count * len(weights)).reshape(count, len(weights))
+
+        if table is not None:
+            v = table[(rolls - 1) @ weights].astype(np.int64)
+            v = v[v > 0]
+        else:
+            v = (rolls - 1) @ weights
+            v //= divider
+            v += 1
+            v = v[v <= die.sides]
 
-        # Calculate the minimum number of dice that can be used.
-        self.num_dice = 0
-        while True:
-            if pow(self.source.sides, self.num_dice) >= self.sides:
-                break
-            self.num_dice += 1
+        die.num_iterations += 1
+        die.num_source_rolls += rolls.size
+        die.num_rejections += count - len(v)
+        die.num_outputs += len(v)
+
+        results.append(v)
+        count -= len(v)
+
+    return np.concatenate(results)
+
+class DieDigits(DieBase):
+    """ The base of DiePower and DieCombo.
+
+    A try combines num_dice source rolls with the radix weights into a
+    number, which is divided by divider and rejected if it does not fit.
+    Subclasses set weights and divider and describe themselves with stage().
+    """
+    def __init__(self, sides, source, num_dice=None):
+        super(DieDigits, self).__init__(sides=sides, source=source)
+
+        # Use the minimum number of dice that can be used, unless told otherwise.
+        self.num_dice = min_num_dice(self.source.sides, self.sides) if num_dice is None else num_dice
+        if pow(self.source.sides, self.num_dice) < self.sides:
+            raise Exception('Cannot make a die with {} sides from {} dice with {} sides.'.format(self.sides, self.num_dice, self.source.sides))
+
+        # Share a lookup table with every other die of this shape, built on first use if it fits.
+        self._table = None
+
+    @property
+    def table(self):
+        if self._table is None and pow(self.source.sides, self.num_dice) <= table_cache.max_table:
+            self._table = self.stage().table
+        return self._table
 
     def roll(self):
         while True:
             rolls = self.source(count=self.num_dice)
+            self.num_iterations += 1
+            self.num_source_rolls += self.num_dice
+
+            v = sum([w * (v - 1) for (w, v) in zip(self.weights, rolls)])
+            if self.table is not None:
+                v = int(self.table[v])
+                if not v:
+                    self.num_rejections += 1
+                    continue
+                self.num_outputs += 1
+                return v
 
-            v = sum([pow(self.source.sides, k) * (v - 1) for (k, v) in enumerate(rolls)])
+            v //= self.divider
             v += 1
+
             if v > self.sides:
+                self.num_rejections += 1
                 continue
 
+            self.num_outputs += 1
             return v
 
+    def roll_batch(self, count=1):
+        return roll_batch_digits(self, count, self.weights, self.divider, table=self.table)
+
+    def check(self, max_table=MAX_TABLE):
+        return check_converter(self, self.divider, max_table)
+
+class DiePower(DieDigits):
+    def __init__(self, sides, source, num_dice=None):
+        super(DiePower, self).__init__(sides=sides, source=source, num_dice=num_dice)
+
+        # The first roll is the least significant digit, and the number is the roll.
+        self.weights = [pow(self.source.sides, k) for k in range(0, self.num_dice)]
+        self.divider = 1
+
+
+    def stage(self):
+        def build():
+            v = np.arange(1, pow(self.source.sides, self.num_dice) + 1, dtype=np.int64)
+            return np.where(v <= self.sides, v, 0).astype(table_dtype(self.sides))
+
+        size = pow(self.source.sides, self.num_dice)
+        table = table_cache.get((DiePower, self.source.sides, self.num_dice, self.sides), size, build)
+        return Stage(self.sides, self.source.sides, np.array(self.weights, dtype=np.int64), table)
+
     def __str__(self):
         return '{}, num_dice={}'.format(super(DiePower, self).__str__(), self.num_dice)
 
@@ -203,6 +1929,12 @@ class TestDiePower(unittest.TestCase):
         self.assertFalse(tester.average_deviation)
         self.assertEqual(die.source.num_rolls // die.source.num_dice, max_rolls)
 
+        # The batched path must give the same rolls from the same source rolls.
+        scalar = DiePower(sides=die.sides, source=DiePerfect(sides=die.source.sides, num_dice=die.source.num_dice))
+        batch = DiePower(sides=die.sides, source=DiePerfect(sides=die.source.sides, num_dice=die.source.num_dice))
+        self.assertEqual(list(batch.roll_batch(count=count)), scalar(count=count))
+        self.assertEqual(batch.source.num_rolls // batch.source.num_dice, max_rolls)
+
     def test_d16_from_2d6(self):
         self.go(count=32, max_rolls=68, die=DiePower(sides=16, source=DiePerfect(sides=6, num_dice=2)))
 
@@ -224,32 +1956,25 @@ class TestDiePower(unittest.TestCase):
     def test_d45_from_2d10(self):
         self.go(count=180, max_rolls=394, die=DiePower(sides=45, source=DiePerfect(sides=10, num_dice=2)))
 
-class DieCombo(DieBase):
-    def __init__(self, sides, source):
-        super(DieCombo, self).__init__(sides=sides, source=source)
-
-        # Calculate the minimum number of dice that can be used.
-        self.num_dice = 0
-        while True:
-            if pow(self.source.sides, self.num_dice) >= self.sides:
-                break
-            self.num_dice += 1
+class DieCombo(DieDigits):
+    def __init__(self, sides, source, num_dice=None):
+        super(DieCombo, self).__init__(sides=sides, source=source, num_dice=num_dice)
 
         # Calculate a divider to minimize re-rolls.
         self.divider = pow(self.source.sides, self.num_dice) // self.sides
 
-    def roll(self):
-        while True:
-            rolls = self.source(count=self.num_dice)
+        # The first roll is the most significant digit.
+        self.weights = [pow(self.source.sides, self.num_dice - k - 1) for k in range(0, self.num_dice)]
 
-            v = sum([pow(self.source.sides, self.num_dice-k-1) * (v - 1) for (k, v) in enumerate(rolls)])
-            v //= self.divider
-            v += 1
 
-            if v > self.sides:
-                continue
+    def stage(self):
+        def build():
+            v = np.arange(0, pow(self.source.sides, self.num_dice), dtype=np.int64) // self.divider + 1
+            return np.where(v <= self.sides, v, 0).astype(table_dtype(self.sides))
 
-            return v
+        size = pow(self.source.sides, self.num_dice)
+        table = table_cache.get((DieCombo, self.source.sides, self.num_dice, self.sides), size, build)
+        return Stage(self.sides, self.source.sides, np.array(self.weights, dtype=np.int64), table)
 
 class TestDieCombo(unittest.TestCase):
     def go(self, count, max_rolls, die):
@@ -259,6 +1984,12 @@ class TestDieCombo(unittest.TestCase):
         self.assertFalse(tester.average_deviation)
         self.assertTrue(die.source.num_rolls // die.source.num_dice <= max_rolls)
 
+        # The batched path must give the same rolls from the same source rolls.
+        scalar = DieCombo(sides=die.sides, source=DiePerfect(sides=die.source.sides, num_dice=die.source.num_dice))
+        batch = DieCombo(sides=die.sides, source=DiePerfect(sides=die.source.sides, num_dice=die.source.num_dice))
+        self.assertEqual(list(batch.roll_batch(count=count)), scalar(count=count))
+        self.assertEqual(batch.source.num_rolls, scalar.source.num_rolls)
+
     def test_d12_from_2d6(self):
         self.go(count=36*4, max_rolls=144, die=DieCombo(sides=12, source=DiePerfect(sides=6, num_dice=2)))
 
@@ -268,6 +1999,1419 @@ class TestDieCombo(unittest.TestCase):
     def test_d45_from_2d10(self):
         self.go(count=45*4, max_rolls=200, die=DieCombo(sides=45, source=DiePerfect(sides=10, num_dice=2)))
 
+class TestRollBatchDigits(unittest.TestCase):
+    def test_random_source(self):
+        scalar = DieCombo(sides=45, source=Die(sides=10, seed=7))
+        batch = DieCombo(sides=45, source=Die(sides=10, seed=7))
+        self.assertEqual(list(batch.roll_batch(count=1000)), scalar(count=1000))
+
+    def test_empty(self):
+        die = DiePower(sides=16, source=DiePerfect(sides=6))
+        self.assertEqual(len(die.roll_batch(count=0)), 0)
+        self.assertEqual(die.source.num_rolls, 0)
+
+class TestTableCache(unittest.TestCase):
+    def test_shared(self):
+        a = DieCombo(sides=4000, source=DiePerfect(sides=8, num_dice=4))
+        b = DieCombo(sides=4000, source=Die(sides=8))
+        self.assertIs(a.table, b.table)
+        self.assertFalse(a.table.flags.writeable)
+        self.assertIsNot(a.table, DiePower(sides=4000, source=Die(sides=8)).table)
+
+    def test_lru(self):
+        cache = TableCache(max_entries=100, max_table=50)
+        build = lambda: np.zeros(40, dtype=np.int64)
+        a = cache.get('a', 40, build)
+        cache.get('b', 40, build)
+        self.assertIs(cache.get('a', 40, build), a)
+        cache.get('c', 40, build)
+        self.assertEqual(list(cache.tables.keys()), ['a', 'c'])
+        self.assertEqual(cache.num_entries, 80)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+        # Too big to keep.
+        cache.get('d', 200, lambda: np.zeros(200, dtype=np.int64))
+        self.assertEqual(list(cache.tables.keys()), ['a', 'c'])
+
+    def test_dtype(self):
+        self.assertEqual(DieCombo(sides=4000, source=Die(sides=8)).table.dtype, np.uint16)
+        self.assertEqual(DiePower(sides=200, source=Die(sides=6)).table.dtype, np.uint8)
+        self.assertEqual(DieDivider(sides=3, source=Die(sides=6)).stage().table.dtype, np.uint8)
+
+    def test_lazy(self):
+        # No table is built until one is needed, and a big one is never cached.
+        tracemalloc.start()
+        die = DieCombo(sides=pow(10, 7), source=Die(sides=10, seed=1))
+        (current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.assertTrue(peak < 1000000)
+        self.assertIsNone(die.table)
+        self.assertEqual(die.roll_batch(count=100).tolist(), DieCombo(sides=pow(10, 7), source=Die(sides=10, seed=1))(count=100))
+
+    def test_large(self):
+        # Too big for a table, so the arithmetic path is used.
+        die = DieCombo(sides=pow(10, 9) + 7, source=Die(sides=6, seed=1))
+        self.assertIsNone(die.table)
+        self.assertEqual(die.roll_batch(count=100).tolist(), DieCombo(sides=pow(10, 9) + 7, source=Die(sides=6, seed=1))(count=100))
+
+    def test_min_num_dice(self):
+        self.assertEqual(min_num_dice(8, 4000), 4)
+        self.assertEqual(min_num_dice(6, 6), 1)
+        self.assertEqual(min_num_dice(6, 1), 0)
+
+class TestInstrumentation(unittest.TestCase):
+    def test_combo(self):
+        source = DiePerfect(sides=10, num_dice=2)
+        die = DieCombo(sides=45, source=source)
+        die(count=90)
+        die.roll_batch(count=90)
+        self.assertEqual(die.num_outputs, 180)
+        self.assertEqual(die.num_source_rolls, source.num_outputs)
+        self.assertEqual(die.num_source_rolls, 2 * (die.num_outputs + die.num_rejections))
+        self.assertEqual(die.num_rejections, 10)
+        self.assertAlmostEqual(die.bits_produced, 180 * math.log2(45))
+        self.assertTrue(0 < die.efficiency < 1)
+
+    def test_report(self):
+        die = DieDivider(sides=5, source=DiePower(sides=10, source=Die(sides=6, seed=1)))
+        die.roll_batch(count=100)
+        die(count=100)
+        report = die.report()
+        logging.info(report)
+        self.assertEqual(len(report.splitlines()), 3)
+        self.assertTrue(report.splitlines()[2].startswith('    Die(sides=6): outputs={}'.format(die.source.num_source_rolls)))
+        self.assertEqual(die.stats()['source_rolls'], 200)
+        self.assertEqual(die.source.stats()['outputs'], 200)
+        self.assertAlmostEqual(die.efficiency, math.log(5) / math.log(10))
+
+    def test_fused(self):
+        die = compile_die(DieCombo(sides=45, source=DiePerfect(sides=10)))
+        die.roll_batch(count=45)
+        self.assertEqual(die.num_source_rolls, die.source.num_outputs)
+        self.assertEqual(die.num_rejections, die.num_source_rolls // 2 - 45)
+
+def smooth_factor(source_sides, sides):
+    """ Split sides into (smooth, rest), where smooth divides a power of source_sides. """
+    smooth = 1
+    rest = sides
+    g = math.gcd(rest, source_sides)
+    while g > 1:
+        smooth *= g
+        rest //= g
+        g = math.gcd(rest, source_sides)
+    return (smooth, rest)
+
+def combo_rolls(source_sides, sides, num_dice=None):
+    """ Return the expected source rolls per output of a DieCombo. """
+    if num_dice is None:
+        num_dice = min_num_dice(source_sides, sides)
+    size = pow(source_sides, num_dice)
+    return Fraction(num_dice * size, sides * (size // sides))
+
+def factor_rolls(source_sides, sides):
+    """ Return the expected source rolls per output of a DieFactor.
+
+    None when sides shares no factor with source_sides, or when a DieCombo
+    would take no more rolls.
+    """
+    (smooth, rest) = smooth_factor(source_sides, sides)
+    if smooth == 1:
+        return None
+
+    num_dice = 1
+    while pow(source_sides, num_dice) % smooth:
+        num_dice += 1
+    rolls = num_dice + (combo_rolls(source_sides, rest) if rest > 1 else 0)
+
+    if rolls > combo_rolls(source_sides, sides):
+        return None
+    return rolls
+
+class DieFactor(DieBase):
+    """ Make a die from two mixed-radix digits, one of them without rejection.
+
+    sides is split into smooth * rest, where every prime factor of smooth
+    divides the source sides. Then smooth divides source.sides ** k for some
+    k, so the smooth digit is a DieCombo over k rolls with an exact divider
+    that never rejects. Only the rest digit, which shares no factor with the
+    source, needs rejection. When rest is 1 every output takes exactly k
+    source rolls.
+
+    The digits read the same source, the smooth digit first and then the
+    tries of the rest digit until one is accepted. roll_batch reads the
+    source in the same order as repeated calls to roll(), see interleave().
+
+    The digits throw away what is left of the source rolls of the smooth
+    digit, so a big smooth digit can cost more than a single DieCombo, e.g.
+    5.07 rather than 4.10 rolls for a d4000 from a d8. Such a die is refused,
+    see factor_rolls.
+    """
+    def __init__(self, sides, source):
+        super(DieFactor, self).__init__(sides=sides, source=source)
+
+        (self.smooth, self.rest) = smooth_factor(self.source.sides, self.sides)
+        if self.smooth == 1:
+            raise Exception('A die with {} sides shares no factor with {} sides.'.format(self.sides, self.source.sides))
+        if factor_rolls(self.source.sides, self.sides) is None:
+            raise Exception('A DieCombo makes a die with {} sides from {} sides with fewer rolls.'.format(self.sides, self.source.sides))
+
+        num_dice = 1
+        while pow(self.source.sides, num_dice) % self.smooth:
+            num_dice += 1
+
+        self.digits = [DieCombo(sides=self.smooth, source=self.source, num_dice=num_dice)]
+        if self.rest > 1:
+            self.digits.append(DieCombo(sides=self.rest, source=self.source))
+
+    def _tally(self, outputs, function, *args):
+        before = [(d.num_source_rolls, d.num_rejections, d.num_iterations) for d in self.digits]
+        rolls = [function(d, *args) for d in self.digits]
+        for (d, (r, j, i)) in zip(self.digits, before):
+            self.num_source_rolls += d.num_source_rolls - r
+            self.num_rejections += d.num_rejections - j
+            self.num_iterations += d.num_iterations - i
+        self.num_outputs += outputs
+        return rolls
+
+    def verify(self, max_table=MAX_TABLE):
+        # The digits read the same source one after the other, so their rolls add up.
+        checks = [digit.check(max_table) for digit in self.digits]
+        return chain_verification(self.source.verify(max_table), checks, sum(stage_rolls(check) for check in checks))
+
+    def roll(self):
+        rolls = self._tally(1, DieCombo.roll)
+        if self.rest == 1:
+            return rolls[0]
+        return (rolls[0] - 1) * self.rest + rolls[1]
+
+    def roll_batch(self, count=1):
+        if self.rest == 1:
+            return self._tally(count, DieCombo.roll_batch, count)[0]
+        if max(pow(self.source.sides, d.num_dice) for d in self.digits) > np.iinfo(np.int64).max:
+            return DieBase.roll_batch(self, count)
+
+        results = [np.empty(0, dtype=np.int64)]
+        leftover = np.empty(0, dtype=np.int64)
+        (k, m) = (self.digits[0].num_dice, self.digits[1].num_dice)
+        while count > 0:
+            # Draw the fewest rolls that could finish the outputs, so none are taken early.
+            if len(leftover) < k:
+                n = k - len(leftover) + m
+            else:
+                n = m - (len(leftover) - k) % m
+            # Splitting the work keeps the doubling in interleave() short.
+            chunk = min(count, 65536)
+            n += (chunk - 1) * (k + m)
+            stream = np.concatenate([leftover, self.source.roll_batch(n)])
+            self.num_source_rolls += n
+            self.num_iterations += 1
+
+            (rolls, leftover) = self.interleave(stream, chunk)
+            self.num_outputs += len(rolls)
+            results.append(rolls)
+            count -= len(rolls)
+
+        return np.concatenate(results)
+
+    def interleave(self, stream, count):
+        """ Split a stream of source rolls into outputs in the order roll() reads them.
+
+        Each output is k rolls for the smooth digit, then tries of m rolls
+        until the rest digit is accepted. Every position of the stream is
+        first given the end of the first accepted try from there on, for
+        each residue modulo m with a reversed running minimum. That gives the
+        start of the next output from the start of any output, and the
+        starts are followed from 0 by repeated doubling. Returns the
+        finished outputs, at most count, and the rolls of the unfinished one.
+        """
+        (smooth, rest) = self.digits
+        (k, m) = (smooth.num_dice, rest.num_dice)
+        size = len(stream)
+        end = size + 1
+
+        # The rest digit of a try starting at each position, and whether it is accepted.
+        num_tries = size - m + 1
+        index = sum((stream[j:j + num_tries] - 1) * w for (j, w) in enumerate(rest.weights))
+        digit = index // rest.divider + 1
+        accepted = np.full(size + 1, end, dtype=np.int64)
+        accepted[:num_tries] = np.where(digit <= self.rest, np.arange(0, num_tries) + m, end)
+        for r in range(0, m):
+            accepted[r::m] = np.minimum.accumulate(accepted[r::m][::-1])[::-1]
+
+        # The start of the next output, or end if the stream runs out first.
+        following = np.full(size + 2, end, dtype=np.int64)
+        following[:size + 1 - k] = accepted[k:]
+
+        starts = np.zeros(1, dtype=np.int64)
+        step = following
+        while len(starts) <= count and starts[-1] != end:
+            starts = np.concatenate([starts, step[starts]])
+            step = step[step]
+        starts = starts[:count + 1]
+        starts = starts[starts != end]
+        done = starts[following[starts] != end][:count]
+
+        tries = accepted[done + k] - m
+        self.num_rejections += int(((tries - done - k) // m).sum())
+        high = ((stream[done[:, None] + np.arange(0, k)] - 1) @ np.array(smooth.weights, dtype=np.int64)) // smooth.divider
+        rolls = high * self.rest + digit[tries]
+
+        if len(done) < len(starts):
+            return (rolls, stream[starts[len(done)]:])
+        return (rolls, stream[size:])
+
+    def __str__(self):
+        return '{}, smooth={}, rest={}'.format(super(DieFactor, self).__str__(), self.smooth, self.rest)
+
+class TestDieFactor(unittest.TestCase):
+    def test_smooth_factor(self):
+        self.assertEqual(smooth_factor(6, 12), (12, 1))
+        self.assertEqual(smooth_factor(6, 60), (12, 5))
+        self.assertEqual(smooth_factor(6, 120), (24, 5))
+        self.assertEqual(smooth_factor(10, 45), (5, 9))
+        self.assertEqual(smooth_factor(6, 35), (1, 35))
+
+    def test_d12_from_d6(self):
+        # Every d12 takes exactly 2 rolls, one full cycle of 2d6 gives each side 3 times.
+        source = DiePerfect(sides=6, num_dice=2)
+        die = DieFactor(sides=12, source=source)
+        tester = DieTester(die)
+        tester.update(die.roll_batch(count=36))
+        self.assertEqual(tester.rolls.tolist(), [3] * 12)
+        self.assertEqual(source.num_rolls, 72)
+        self.assertEqual(die.num_rejections, 0)
+
+        die = DieFactor(sides=12, source=DiePerfect(sides=6, num_dice=2))
+        self.assertEqual(sorted(die(count=36)), sorted([v for v in range(1, 13)] * 3))
+
+    def test_d60_from_d6(self):
+        source = Die(sides=6, seed=1)
+        die = DieFactor(sides=60, source=source)
+        tester = DieTester(die)
+        tester.update(die.roll_batch(count=60000))
+        tester.update(np.array(die(count=6000)))
+        logging.info(tester.summary())
+        self.assertTrue(tester.chi_square().p_value > 0.001)
+        self.assertEqual(die.num_source_rolls, source.num_outputs)
+        self.assertEqual(die.num_outputs, 66000)
+
+        # Cheaper than a DieCombo, which needs 3.6 rolls per output.
+        self.assertTrue(die.num_source_rolls / die.num_outputs < 3.3)
+        self.assertEqual(verify_uniform(die).source_rolls, 2 + Fraction(6, 5))
+        self.assertEqual(verify_uniform(DieCombo(sides=60, source=Die(sides=6))).source_rolls, Fraction(18, 5))
+
+    def test_batch(self):
+        # The batched path reads the source in the same order as roll().
+        for (sides, source_sides) in ((60, 6), (120, 6), (70, 6), (45, 10), (294, 6)):
+            scalar = DieFactor(sides=sides, source=Die(sides=source_sides, seed=sides))
+            batch = DieFactor(sides=sides, source=Die(sides=source_sides, seed=sides))
+            rolls = batch.roll_batch(count=1).tolist() + batch.roll_batch(count=500).tolist() + batch.roll_batch(count=37).tolist()
+            self.assertEqual(rolls, scalar(count=538))
+            self.assertEqual(batch.source.num_outputs, scalar.source.num_outputs)
+            self.assertEqual((batch.num_source_rolls, batch.num_rejections), (scalar.num_source_rolls, scalar.num_rejections))
+
+    def test_no_factor(self):
+        with self.assertRaises(Exception):
+            DieFactor(sides=35, source=Die(sides=6))
+
+    def test_factor_rolls(self):
+        for (sides, source_sides) in ((60, 6), (120, 6), (45, 10), (12, 6)):
+            die = DieFactor(sides=sides, source=Die(sides=source_sides))
+            self.assertEqual(factor_rolls(source_sides, sides), verify_uniform(die).source_rolls)
+        self.assertEqual(combo_rolls(6, 60), verify_uniform(DieCombo(sides=60, source=Die(sides=6))).source_rolls)
+
+        # The smooth digit wastes too much of its rolls.
+        for (sides, source_sides) in ((4000, 8), (1000000, 6), (35, 6)):
+            self.assertIsNone(factor_rolls(source_sides, sides))
+            with self.assertRaises(Exception):
+                DieFactor(sides=sides, source=Die(sides=source_sides))
+
+@functools.lru_cache(maxsize=4096)
+def multi_counts(source_sides, sides):
+    """ Return how many rolls of each source die make one try of a DieMulti.
+
+    The counts with the fewest expected source rolls per output,
+    sum(counts) * size / accepted, win and ties go to the smaller size. Dice
+    with the same sides are interchangeable, so only the total for each
+    number of sides is searched, and it goes to the first such die. The
+    search goes one number of sides at a time and drops any branch that
+    cannot beat the best so far: a try never costs less than its rolls, and
+    reaching sides needs at least as many more rolls as the largest die left
+    would.
+    """
+    distinct = sorted(set(s for s in source_sides if s > 1), reverse=True)
+    best = [None]
+
+    def search(k, counts, num_rolls, size):
+        if size >= sides:
+            cost = (Fraction(num_rolls * size, (size // sides) * sides), size)
+            if best[0] is None or cost < best[0][0]:
+                best[0] = (cost, counts)
+        if k == len(distinct):
+            return
+
+        # The largest die left gives the fewest rolls still needed.
+        needed = 0
+        while size * pow(distinct[k], needed) < sides:
+            needed += 1
+        for c in range(0, min_num_dice(distinct[k], sides) + 2):
+            if best[0] is not None and num_rolls + max(c, needed) > best[0][0][0]:
+                break
+            search(k + 1, counts + (c,), num_rolls + c, size * pow(distinct[k], c))
+
+    search(0, (), 0, 1)
+    if best[0] is None:
+        raise Exception('Cannot make a die with {} sides from dice with {} sides.'.format(sides, list(source_sides)))
+
+    totals = dict(zip(distinct, best[0][1]))
+    counts = []
+    for s in source_sides:
+        counts.append(totals.get(s, 0))
+        totals[s] = 0
+    return tuple(counts)
+
+class DieMulti(DieBase):
+    """ Make a die from several source dice with different sides.
+
+    Each try takes counts[i] rolls from sources[i], chosen by multi_counts,
+    and reads them as the digits of one mixed-radix number, the first source
+    most significant. As in DieCombo, the number is divided by the largest
+    divider that fits and too large results are rolled again. A batch draws
+    the rolls for every try from each source in one call, and each source is
+    read in the same order as by repeated calls to roll().
+    """
+    def __init__(self, sides, sources):
+        super(DieMulti, self).__init__(sides=sides, source=None)
+        self.source_dice = list(sources)
+        self.counts = multi_counts(tuple(d.sides for d in self.source_dice), self.sides)
+        self.num_rolls = [0] * len(self.source_dice)
+
+        # The last digit of the last source is the least significant.
+        radixes = [d.sides for (d, c) in zip(self.source_dice, self.counts) for i in range(0, c)]
+        self.weights = [functools.reduce(lambda a, b: a * b, radixes[k + 1:], 1) for k in range(0, len(radixes))]
+        self.size = functools.reduce(lambda a, b: a * b, radixes, 1)
+        self.divider = self.size // self.sides
+
+    def sources(self):
+        return self.source_dice
+
+    def verify(self, max_table=MAX_TABLE):
+        # Each try takes counts[i] rolls of sources[i], so the rolls of the dice under them add up.
+        check = StageCheck(type(self).__name__, self.sides, tuple(d.sides for d in self.source_dice), sum(self.counts), self.size, self.divider * self.sides, self.divider, self.divider)
+        used = [(d.verify(max_table), c) for (d, c) in zip(self.source_dice, self.counts) if c]
+        rolls = sum(v.source_rolls * c for (v, c) in used) * Fraction(self.size, check.accepted)
+        uniform = all(v.uniform for (v, c) in used) and check_uniform(check)
+        return Verification(uniform, rolls, [d for (v, c) in used for d in v.sources], [s for (v, c) in used for s in v.stages] + [check])
+
+    def reseed(self, seed):
+        for (die, child) in zip(self.source_dice, seed_sequence(seed).spawn(len(self.source_dice))):
+            die.reseed(child)
+
+    @property
+    def bits_consumed(self):
+        return sum(n * math.log2(d.sides) for (d, n) in zip(self.source_dice, self.num_rolls))
+
+    def draw(self, count):
+        self.num_iterations += 1
+        self.num_source_rolls += count * sum(self.counts)
+        rolls = []
+        for (k, (die, c)) in enumerate(zip(self.source_dice, self.counts)):
+            if c:
+                rolls.append(die.roll_batch(count * c).reshape(count, c))
+                self.num_rolls[k] += count * c
+        return np.concatenate(rolls, axis=1)
+
+    def roll(self):
+        while True:
+            rolls = self.draw(1)[0].tolist()
+            v = sum([w * (v - 1) for (w, v) in zip(self.weights, rolls)]) // self.divider + 1
+            if v <= self.sides:
+                self.num_outputs += 1
+                return v
+            self.num_rejections += 1
+
+    def roll_batch(self, count=1):
+        if self.size > np.iinfo(np.int64).max:
+            return DieBase.roll_batch(self, count)
+
+        weights = np.array(self.weights, dtype=np.int64)
+        results = [np.empty(0, dtype=np.int64)]
+        while count > 0:
+            v = (self.draw(count) - 1) @ weights
+            v //= self.divider
+            v += 1
+            v = v[v <= self.sides]
+            self.num_rejections += count - len(v)
+            self.num_outputs += len(v)
+            results.append(v)
+            count -= len(v)
+
+        return np.concatenate(results)
+
+    def __str__(self):
+        return 'sides={}, sources={}'.format(self.sides, ['d{} x {}'.format(d.sides, c) for (d, c) in zip(self.source_dice, self.counts)])
+
+class TestDieMulti(unittest.TestCase):
+    def test_counts(self):
+        self.assertEqual(multi_counts((6, 10), 60), (1, 1))
+        self.assertEqual(multi_counts((6, 10), 100), (0, 2))
+        self.assertEqual(multi_counts((6, 10), 6), (1, 0))
+        self.assertEqual(multi_counts((6, 10, 1), 30), (1, 1, 0))
+        with self.assertRaises(Exception):
+            multi_counts((1,), 6)
+
+    def test_d60_from_d6_d10(self):
+        # One d6 and one d10 make a d60 with no rejection.
+        sources = [Die(sides=6, seed=1), Die(sides=10, seed=2)]
+        die = DieMulti(sides=60, sources=sources)
+        rolls = die.roll_batch(count=600)
+        self.assertEqual(rolls.tolist(), ((Die(sides=6, seed=1).roll_batch(600) - 1) * 10 + Die(sides=10, seed=2).roll_batch(600)).tolist())
+        self.assertEqual((sources[0].num_outputs, sources[1].num_outputs), (600, 600))
+        self.assertEqual(die.num_rejections, 0)
+        self.assertAlmostEqual(die.efficiency, 1)
+
+    def test_batch(self):
+        build = lambda: DieMulti(sides=1000, sources=[Die(sides=6, seed=1), Die(sides=10, seed=2), Die(sides=20, seed=3)])
+        scalar = build()
+        batch = build()
+        self.assertEqual(batch.roll_batch(count=1000).tolist(), scalar(count=1000))
+        self.assertEqual(batch.num_rolls, scalar.num_rolls)
+        self.assertEqual(batch.num_source_rolls, sum(batch.num_rolls))
+        self.assertEqual(len(batch.report().splitlines()), 4)
+
+        tester = DieTester(batch)
+        tester(count=100000)
+        self.assertTrue(tester.chi_square().p_value > 0.001)
+
+    def test_uniform(self):
+        die = DieMulti(sides=30, sources=[DiePerfect(sides=6), DiePerfect(sides=10)])
+        self.assertEqual(die.counts, (1, 1))
+        v = verify_uniform(die)
+        self.assertTrue(v.uniform)
+        self.assertEqual(v.sources, die.sources())
+        self.assertEqual(v.source_rolls, 2)
+
+        # The sources are verified too.
+        die = DieMulti(sides=30, sources=[DieDivider(sides=6, source=DiePerfect(sides=12)), DieCombo(sides=10, source=Die(sides=6))])
+        v = verify_uniform(die)
+        self.assertTrue(v.uniform)
+        self.assertEqual([d.sides for d in v.sources], [12, 6])
+        self.assertEqual(len(v.stages), 3)
+        self.assertEqual(v.source_rolls, 1 + Fraction(2 * 36, 30))
+
+        with self.assertRaises(Exception):
+            verify_uniform(DieMulti(sides=30, sources=[DieEntropy(sides=6, source=Die(sides=4)), DieCombo(sides=10, source=Die(sides=6))]))
+
+        # Two d10 beat one d6 and one d10 for a d45.
+        die = DieMulti(sides=45, sources=[DiePerfect(sides=6), DiePerfect(sides=10)])
+        self.assertEqual(die.counts, (0, 2))
+        self.assertEqual(verify_uniform(die).source_rolls, Fraction(20, 9))
+
+    def test_many_sources(self):
+        # The search stays fast with many sources.
+        start = time.perf_counter()
+        counts = multi_counts((4, 6, 8, 10, 12, 20, 3, 7, 9, 11), pow(10, 6))
+        self.assertTrue(time.perf_counter() - start < 1)
+        self.assertEqual(sum(counts), 5)
+        self.assertEqual(multi_counts((6, 6, 6), 36), (2, 0, 0))
+
+    def test_large(self):
+        # Too big for numpy arithmetic, so each roll is made with Python integers.
+        sides = pow(2, 62) + 1
+        die = DieMulti(sides=sides, sources=[Die(sides=6, seed=1), Die(sides=10, seed=2)])
+        self.assertTrue(die.size > np.iinfo(np.int64).max)
+        rolls = die.roll_batch(count=10)
+        self.assertEqual(len(rolls), 10)
+        self.assertTrue(all(1 <= r <= sides for r in rolls.tolist()))
+
+class DieEntropy(DieBase):
+    """ Convert a source die to any number of sides without wasting entropy.
+
+    The unused randomness is kept as a value uniformly distributed over
+    [0, range). Source rolls are appended as new low digits until the range
+    is at least sides * 2**precision, then a roll is extracted. A rejected
+    value and the quotient left after an accepted roll both stay uniform over
+    a smaller range, so they are carried into the next call instead of being
+    thrown away.
+    """
+    def __init__(self, sides, source, precision=16):
+        super(DieEntropy, self).__init__(sides=sides, source=source)
+        self.precision = precision
+        self.limit = self.sides << self.precision
+        self.value = 0
+        self.range = 1
+
+    def roll(self):
+        while True:
+            self.num_iterations += 1
+            while self.range < self.limit:
+                self.value = self.value * self.source.sides + self.source.roll() - 1
+                self.range *= self.source.sides
+                self.num_source_rolls += 1
+
+            quotient = self.range // self.sides
+            accepted = quotient * self.sides
+            if self.value < accepted:
+                self.value, v = divmod(self.value, self.sides)
+                self.range = quotient
+                self.num_outputs += 1
+                return v + 1
+
+            # Keep the rejected remainder, it is uniform over what is left.
+            self.value -= accepted
+            self.range -= accepted
+            self.num_rejections += 1
+
+    def __str__(self):
+        return '{}, precision={}'.format(super(DieEntropy, self).__str__(), self.precision)
+
+class TestDieEntropy(unittest.TestCase):
+    def go(self, sides, source_sides, length, precision, outputs=2):
+        """ Run the die over every possible sequence of length source rolls.
+
+        Every combination of outputs that was decided within the sequence must
+        occur the same number of times.
+        """
+        counts = {}
+        for n in range(0, pow(source_sides, length)):
+            source = DiePerfect(sides=source_sides, num_dice=length)
+            source.seek(n * length)
+            die = DieEntropy(sides=sides, source=source, precision=precision)
+            rolls = tuple(die(count=outputs))
+            if source.num_rolls <= length:
+                counts[rolls] = counts.get(rolls, 0) + 1
+
+        self.assertEqual(len(counts), pow(sides, outputs))
+        self.assertEqual(len(set(counts.values())), 1)
+
+    def test_d45_from_d10(self):
+        self.go(sides=45, source_sides=10, length=5, precision=0)
+
+    def test_d12_from_d6(self):
+        self.go(sides=12, source_sides=6, length=6, precision=2)
+
+    def test_d3_from_d2(self):
+        self.go(sides=3, source_sides=2, length=14, precision=4, outputs=3)
+
+    def test_efficiency(self):
+        source = DiePerfect(sides=10)
+        die = DieEntropy(sides=45, source=source)
+        tester = DieTester(die)
+        tester(count=20000)
+        logging.info(tester.summary())
+        self.assertTrue(tester.average_deviation < 0.25)
+        self.assertTrue(source.num_rolls / 20000 < 1.01 * math.log(45) / math.log(10))
+        self.assertEqual(die.num_source_rolls, source.num_rolls)
+        self.assertTrue(die.efficiency > 0.99)
+
+class DieFused(DieBase):
+    """ A chain of DieDivider, DiePower and DieCombo compiled into lookup tables.
+
+    The source chain is walked down to the first die that has no stage(), or
+    whose table is too big to cache, which becomes the source of the fused
+    die. Each converter becomes a Stage, and a stage that takes one roll and
+    never rejects (a DieDivider) is folded into the table of its neighbour.
+    The remaining stages run as vectorized rejection loops that consume
+    source rolls in the same order as the interpreted chain, so both produce
+    the same rolls. Scalar rolls walk the same tables one roll at a time.
+
+    The source is shared with the original chain, not copied.
+    """
+    def __init__(self, die, max_table=4194304):
+        stages = []
+        while hasattr(die, 'stage') and pow(die.source.sides, die.num_dice) <= table_cache.max_table:
+            stages.insert(0, die.stage())
+            die = die.source
+
+        super(DieFused, self).__init__(sides=stages[-1].sides if stages else die.sides, source=die)
+        self.max_table = max_table
+
+        # Fold each stage into the one below it where possible.
+        self.stages = []
+        for stage in stages:
+            if self.stages and self.fusable(self.stages[-1], stage):
+                self.stages[-1] = DieFused.fuse(self.stages[-1], stage)
+            else:
+                self.stages.append(stage)
+        self.weights = [stage.weights.tolist() for stage in self.stages]
+
+    @staticmethod
+    def is_map(stage):
+        return len(stage.weights) == 1 and stage.table.all()
+
+    def fusable(self, lower, upper):
+        if DieFused.is_map(upper):
+            return True
+        return DieFused.is_map(lower) and pow(lower.source_sides, len(upper.weights)) <= self.max_table
+
+    @staticmethod
+    def fuse(lower, upper):
+        if DieFused.is_map(upper):
+            # Relabel the outputs of the lower stage.
+            table = np.where(lower.table > 0, upper.table[lower.table.astype(np.int64) - 1], 0).astype(upper.table.dtype)
+            return Stage(upper.sides, lower.source_sides, lower.weights, table)
+
+        # Push the lower stage's relabelling into the index of the upper stage.
+        num_dice = len(upper.weights)
+        weights = np.array([pow(lower.source_sides, num_dice - k - 1) for k in range(0, num_dice)], dtype=np.int64)
+        index = np.arange(0, pow(lower.source_sides, num_dice), dtype=np.int64)
+        digits = (index[:, None] // weights) % lower.source_sides
+        table = upper.table[(lower.table[digits].astype(np.int64) - 1) @ upper.weights]
+        return Stage(upper.sides, lower.source_sides, weights, table)
+
+    def verify(self, max_table=MAX_TABLE):
+        checks = [check_table(type(self).__name__, stage) for stage in self.stages]
+        return chain_verification(self.source.verify(max_table), checks)
+
+    def run(self, level, count):
+        if level < 0:
+            self.num_source_rolls += count
+            return self.source.roll_batch(count)
+
+        stage = self.stages[level]
+        num_dice = len(stage.weights)
+        results = [np.empty(0, dtype=np.int64)]
+        while count > 0:
+            rolls = self.run(level - 1, count * num_dice).reshape(count, num_dice)
+            v = stage.table[(rolls - 1) @ stage.weights].astype(np.int64)
+            v = v[v > 0]
+            self.num_iterations += 1
+            self.num_rejections += count - len(v)
+            results.append(v)
+            count -= len(v)
+
+        return np.concatenate(results)
+
+    def run_one(self, level):
+        if level < 0:
+            self.num_source_rolls += 1
+            return self.source.roll()
+
+        table = self.stages[level].table
+        weights = self.weights[level]
+        while True:
+            index = 0
+            for weight in weights:
+                index += (self.run_one(level - 1) - 1) * weight
+            v = table.item(index)
+            self.num_iterations += 1
+            if v:
+                return v
+            self.num_rejections += 1
+
+    def roll(self):
+        self.num_outputs += 1
+        return self.run_one(len(self.stages) - 1)
+
+    def roll_batch(self, count=1):
+        self.num_outputs += count
+        return self.run(len(self.stages) - 1, count)
+
+    def __str__(self):
+        return '{}, stages={}'.format(super(DieFused, self).__str__(), [(s.source_sides, len(s.weights), s.sides) for s in self.stages])
+
+def compile_die(die, max_table=4194304):
+    """ Return a DieFused that rolls the same as die. """
+    return DieFused(die, max_table=max_table)
+
+class TestDieFused(unittest.TestCase):
+    def go(self, build, count, num_stages, seed=None):
+        if seed is None:
+            interpreted = build(DiePerfect(sides=6, num_dice=3))
+            fused = compile_die(build(DiePerfect(sides=6, num_dice=3)))
+        else:
+            interpreted = build(Die(sides=6, seed=seed))
+            fused = compile_die(build(Die(sides=6, seed=seed)))
+        logging.info(fused)
+
+        self.assertEqual(fused.sides, interpreted.sides)
+        self.assertEqual(len(fused.stages), num_stages)
+        self.assertEqual(fused.roll_batch(count=count).tolist(), interpreted(count=count))
+        self.assertEqual(fused(count=3), interpreted.roll_batch(count=3).tolist())
+        self.assertEqual(fused(count=count), interpreted(count=count))
+
+        # Both took the same number of rolls from their sources.
+        source = interpreted
+        while source.sources():
+            source = source.source
+        self.assertEqual(fused.source.num_outputs, source.num_outputs)
+
+    def test_divider(self):
+        self.go(lambda source: DieDivider(sides=3, source=source), count=100, num_stages=1)
+
+    def test_divider_divider(self):
+        self.go(lambda source: DieDivider(sides=2, source=DieDivider(sides=6, source=DieCombo(sides=12, source=source))), count=100, num_stages=1)
+
+    def test_chain(self):
+        build = lambda source: DieDivider(sides=5, source=DieCombo(sides=45, source=DiePower(sides=10, source=DieDivider(sides=3, source=source))))
+        self.go(build, count=500, num_stages=2)
+        self.go(build, count=500, num_stages=2, seed=1)
+
+    def test_power_combo(self):
+        build = lambda source: DieCombo(sides=200, source=DiePower(sides=16, source=source))
+        self.go(build, count=500, num_stages=2, seed=2)
+
+    def test_max_table(self):
+        build = lambda: DieCombo(sides=4000, source=DieDivider(sides=8, source=Die(sides=24, seed=3)))
+        self.assertEqual(len(compile_die(build()).stages), 1)
+        die = compile_die(build(), max_table=1000)
+        self.assertEqual(len(die.stages), 2)
+        self.assertEqual(die(count=100), build()(count=100))
+
+    def test_opaque_source(self):
+        entropy = DieEntropy(sides=7, source=Die(sides=6, seed=4))
+        die = compile_die(DieCombo(sides=45, source=entropy))
+        self.assertIs(die.source, entropy)
+        self.assertEqual(die(count=100), DieCombo(sides=45, source=DieEntropy(sides=7, source=Die(sides=6, seed=4)))(count=100))
+
+StageCheck = namedtuple('StageCheck', ['name', 'sides', 'source_sides', 'num_dice', 'size', 'accepted', 'min_ways', 'max_ways'])
+StageCheck.__doc__ = """ How one converter maps its size combinations of num_dice source rolls.
+
+accepted combinations give a roll and the rest are rejected. Every roll
+from 1 to sides is made by between min_ways and max_ways combinations.
+"""
+
+Verification = namedtuple('Verification', ['uniform', 'source_rolls', 'sources', 'stages'])
+Verification.__doc__ = """ The result of verify_uniform.
+
+uniform is True when every stage gives each roll the same number of ways,
+source_rolls is the exact expected number of rolls of the dice in sources
+per output as a Fraction, and stages holds a StageCheck for each
+converter, lowest first.
+"""
+
+def check_table(name, stage):
+    """ Count the ways to make each roll in a Stage table. """
+    ways = np.bincount(stage.table.astype(np.intp), minlength=stage.sides + 1)
+    if len(ways) > stage.sides + 1:
+        # The table makes rolls bigger than the die.
+        return StageCheck(name, stage.sides, stage.source_sides, len(stage.weights), len(stage.table), len(stage.table) - int(ways[0]), 0, -1)
+    return StageCheck(name, stage.sides, stage.source_sides, len(stage.weights), len(stage.table), len(stage.table) - int(ways[0]), int(ways[1:].min()), int(ways[1:].max()))
+
+def check_converter(die, ways, max_table):
+    """ Count the ways to make each roll of a converter with a stage().
+
+    Small converters are checked by counting their lookup table. Bigger ones
+    are counted from their arithmetic, which makes every roll from ways
+    combinations of source rolls.
+    """
+    size = pow(die.source.sides, die.num_dice)
+    if size <= max_table:
+        return check_table(type(die).__name__, die.stage())
+    return StageCheck(type(die).__name__, die.sides, die.source.sides, die.num_dice, size, ways * die.sides, ways, ways)
+
+def check_uniform(check):
+    return check.min_ways == check.max_ways and check.min_ways > 0
+
+def stage_rolls(check):
+    """ Expected rolls per output of a stage that takes num_dice rolls per try. """
+    if not check.accepted:
+        return math.inf
+    return Fraction(check.num_dice * check.size, check.accepted)
+
+def chain_verification(source, checks, rolls=None):
+    """ Add stages on top of the Verification of their source.
+
+    The stages multiply the source rolls by rolls, by default the product of
+    the rolls of each stage.
+    """
+    if rolls is None:
+        rolls = functools.reduce(lambda a, b: a * b, [stage_rolls(check) for check in checks], Fraction(1))
+    uniform = source.uniform and all(check_uniform(check) for check in checks)
+    return Verification(uniform, source.source_rolls * rolls, source.sources, source.stages + checks)
+
+def verify_uniform(die, max_table=MAX_TABLE):
+    """ Prove that a chain of deterministic converters is exactly uniform, without rolling it.
+
+    Each die describes itself with verify(), down to the dice without a
+    source, which are assumed to be uniform. A stage takes num_dice rolls
+    per try and accepts accepted of size tries, so it needs
+    num_dice * size / accepted rolls per output, and the stages multiply.
+    The digits of a DieFactor and the sources of a DieMulti add up their
+    rolls instead. Tables up to max_table entries are counted, bigger stages
+    are counted from their arithmetic. Raises an Exception for a die whose
+    output is not a fixed function of its source rolls.
+    """
+    return die.verify(max_table)
+
+class TestVerifyUniform(unittest.TestCase):
+    def test_d4000_from_4d8(self):
+        for cls in (DiePower, DieCombo):
+            v = verify_uniform(cls(sides=4000, source=Die(sides=8)))
+            self.assertTrue(v.uniform)
+            self.assertEqual(v.source_rolls, Fraction(4 * 4096, 4000))
+            self.assertEqual(v.stages[0].accepted, 4000)
+
+    def test_combo(self):
+        v = verify_uniform(DieCombo(sides=45, source=DiePerfect(sides=10)))
+        self.assertEqual(v.stages[0].min_ways, 2)
+        self.assertEqual(v.source_rolls, Fraction(20, 9))
+        self.assertEqual(v.stages[0], StageCheck('DieCombo', 45, 10, 2, 100, 90, 2, 2))
+
+    def test_chain(self):
+        die = DieDivider(sides=5, source=DieCombo(sides=45, source=DiePower(sides=10, source=DieDivider(sides=3, source=Die(sides=6)))))
+        v = verify_uniform(die)
+        self.assertTrue(v.uniform)
+        self.assertEqual(len(v.stages), 4)
+        self.assertEqual([d.sides for d in v.sources], [6])
+        self.assertEqual(v.source_rolls, Fraction(1) * Fraction(3 * 27, 10) * Fraction(2 * 100, 90) * 1)
+
+        fused = compile_die(die)
+        self.assertEqual(verify_uniform(fused).source_rolls, v.source_rolls)
+        self.assertTrue(verify_uniform(fused).uniform)
+
+    def test_symbolic(self):
+        sides = pow(10, 9) + 7
+        die = DieCombo(sides=sides, source=Die(sides=6))
+        start = time.perf_counter()
+        v = verify_uniform(die)
+        self.assertTrue(time.perf_counter() - start < 0.1)
+        self.assertTrue(v.uniform)
+        self.assertEqual(v.stages[0].num_dice, 12)
+        self.assertEqual(v.source_rolls, Fraction(12 * pow(6, 12), 2 * sides))
+
+        # The same answer as counting the table.
+        v = verify_uniform(DieCombo(sides=4000, source=Die(sides=8)), max_table=0)
+        self.assertEqual(v.stages, verify_uniform(DieCombo(sides=4000, source=Die(sides=8))).stages)
+
+    def test_broken(self):
+        die = compile_die(DieCombo(sides=45, source=Die(sides=10)))
+        table = die.stages[0].table.copy()
+        table[-1] = 1
+        die.stages[0] = die.stages[0]._replace(table=table)
+        v = verify_uniform(die)
+        self.assertFalse(v.uniform)
+        self.assertEqual((v.stages[0].min_ways, v.stages[0].max_ways), (2, 3))
+
+    def test_subclass(self):
+        class DieCounted(DieCombo):
+            pass
+
+        die = DieCounted(sides=45, source=Die(sides=10))
+        self.assertEqual(verify_uniform(die).stages[0].name, 'DieCounted')
+        self.assertEqual(len(compile_die(die).stages), 1)
+        self.assertTrue(verify_uniform(compile_die(die)).uniform)
+
+    def test_not_deterministic(self):
+        with self.assertRaises(Exception):
+            verify_uniform(DieCombo(sides=45, source=DieEntropy(sides=10, source=Die(sides=6))))
+
+Plan = namedtuple('Plan', ['name', 'build', 'source_rolls', 'seconds', 'score'])
+Plan.__doc__ = """ A way to make a die from a source die, see plan_conversion.
+
+build(source) returns the die. source_rolls is the expected number of source
+rolls per output, exact as a Fraction where verify_uniform can prove it.
+seconds is the measured time per output spent in the converters themselves,
+and score is the estimated time per output including the source rolls.
+"""
+
+def conversion_candidates(source_sides, sides):
+    """ Yield (name, build) for every plan considered by plan_conversion. """
+    if source_sides % sides == 0:
+        yield 'DieDivider', lambda source: DieDivider(sides=sides, source=source)
+
+    num_dice = min_num_dice(source_sides, sides)
+    yield 'DiePower', lambda source: DiePower(sides=sides, source=source)
+
+    # More dice than the minimum give a finer divider and fewer rejections.
+    for k in range(num_dice, num_dice + 4):
+        if pow(source_sides, k) > pow(2, 62):
+            break
+        yield 'DieCombo(num_dice={})'.format(k), lambda source, k=k: DieCombo(sides=sides, source=source, num_dice=k)
+
+    # Go through a smaller die that divides the source exactly.
+    for d in range(2, source_sides):
+        if source_sides % d == 0 and d >= sides:
+            yield 'DieCombo(DieDivider({}))'.format(d), lambda source, d=d: DieCombo(sides=sides, source=DieDivider(sides=d, source=source))
+
+    if factor_rolls(source_sides, sides) is not None:
+        yield 'DieFactor', lambda source: DieFactor(sides=sides, source=source)
+
+    yield 'DieEntropy', lambda source: DieEntropy(sides=sides, source=source)
+
+def time_die(die, count, repeat=3):
+    """ Return the best time in seconds to roll count rolls in a batch. """
+    best = math.inf
+    for i in range(0, repeat):
+        start = time.perf_counter()
+        die.roll_batch(count)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def conversion_plans(source_sides, sides, roll_cost=None, count=20000):
+    """ Return a Plan for every candidate, cheapest first.
+
+    Every candidate is scored by its converter time per output plus its
+    expected source rolls per output times roll_cost, the seconds each source
+    roll costs. By default roll_cost is the measured time of a numpy Die, so
+    a slow hardware source should pass its own cost.
+    """
+    source_seconds = time_die(Die(sides=source_sides, seed=0), count) / count
+    if roll_cost is None:
+        roll_cost = source_seconds
+
+    plans = []
+    for (name, build) in conversion_candidates(source_sides, sides):
+        die = build(Die(sides=source_sides, seed=0))
+        seconds = time_die(die, count) / count
+        try:
+            source_rolls = verify_uniform(die).source_rolls
+        except Exception:
+            # Not a fixed mapping, so use the measured rate.
+            source_rolls = die.num_source_rolls / die.num_outputs
+
+        # Take away the time spent in the source die itself.
+        seconds = max(0.0, seconds - float(source_rolls) * source_seconds)
+        plans.append(Plan(name, build, source_rolls, seconds, seconds + float(source_rolls) * roll_cost))
+        logging.debug(plans[-1])
+
+    return sorted(plans, key=lambda plan: plan.score)
+
+@functools.lru_cache(maxsize=1024)
+def plan_conversion(source_sides, sides, roll_cost=None):
+    """ Return the cheapest Plan, cached per (source_sides, sides, roll_cost). """
+    return conversion_plans(source_sides, sides, roll_cost)[0]
+
+def plan_die(source, sides, roll_cost=None):
+    """ Return the cheapest die with sides sides made from source. """
+    return plan_conversion(source.sides, sides, roll_cost).build(source)
+
+class TestPlanConversion(unittest.TestCase):
+    def test_divider(self):
+        plan = plan_conversion(6, 3)
+        self.assertEqual(plan.source_rolls, 1)
+
+    def test_more_dice(self):
+        # Three d6 waste less than two for a d19: 209 of 216 are used against 19 of 36.
+        plans = {plan.name: plan for plan in conversion_plans(6, 19, count=1000)}
+        self.assertEqual(plans['DieCombo(num_dice=2)'].source_rolls, Fraction(2 * 36, 19))
+        self.assertEqual(plans['DieCombo(num_dice=3)'].source_rolls, Fraction(3 * 216, 209))
+        self.assertTrue(plans['DieEntropy'].source_rolls < 1.7)
+
+    def test_roll_cost(self):
+        # When source rolls are slow the entropy converter wins.
+        self.assertEqual(plan_conversion(6, 19, roll_cost=1e-3).name, 'DieEntropy')
+        self.assertNotEqual(plan_conversion(6, 19, roll_cost=0.0).name, 'DieEntropy')
+
+    def test_cache(self):
+        self.assertIs(plan_conversion(10, 45), plan_conversion(10, 45))
+
+    def test_factor(self):
+        plans = {plan.name: plan for plan in conversion_plans(6, 120, count=1000)}
+        self.assertEqual(plans['DieFactor'].source_rolls, 3 + Fraction(6, 5))
+        self.assertEqual(min((p for p in plans.values() if p.name != 'DieEntropy'), key=lambda p: p.source_rolls).name, 'DieFactor')
+
+    def test_plan_die(self):
+        source = Die(sides=10, seed=1)
+        die = plan_die(source, 45)
+        self.assertIs(die.sources()[0], source)
+        rolls = die.roll_batch(count=1000)
+        self.assertTrue(rolls.min() >= 1 and rolls.max() <= 45)
+        self.assertTrue(verify_uniform(die).uniform)
+
+DiceTerm = namedtuple('DiceTerm', ['sign', 'count', 'sides', 'keep', 'num_kept', 'source_count', 'source_sides'])
+
+def parse_expression(text):
+    """ Parse a dice expression into a list of DiceTerm and signed integers.
+
+    An expression is a sum of terms like 3d6, d20, 4d6kh3 (keep the highest
+    3), 2d20kl1 (keep the lowest 1), d45 from 2d10 (a d45 made from d10s) and
+    integer modifiers, for example '4d6kh3 + d45 from 2d10 - 2'.
+    """
+    term = re.compile(r'([+-]?)(?:(\d*)d(\d+)(?:(kh|kl)(\d+))?(?:from(\d*)d(\d+))?|(\d+))')
+    compact = re.sub(r'\s+', '', text.lower())
+    if not compact:
+        raise ValueError('Empty dice expression.')
+
+    terms = []
+    position = 0
+    while position < len(compact):
+        match = term.match(compact, position)
+        if not match or match.end() == position or (terms and not match.group(1)):
+            raise ValueError('Cannot parse dice expression {!r} at {!r}.'.format(text, compact[position:]))
+        position = match.end()
+
+        (sign, count, sides, keep, num_kept, source_count, source_sides, constant) = match.groups()
+        sign = -1 if sign == '-' else 1
+        if constant is not None:
+            terms.append(sign * int(constant))
+            continue
+
+        count = int(count) if count else 1
+        sides = int(sides)
+        num_kept = int(num_kept) if keep else count
+        if count < 1 or sides < 1 or not 1 <= num_kept <= count:
+            raise ValueError('Invalid dice {!r} in {!r}.'.format(match.group(0), text))
+
+        if source_sides is not None:
+            source_sides = int(source_sides)
+            if source_sides < 2:
+                raise ValueError('Cannot make dice from d{} in {!r}.'.format(source_sides, text))
+
+            needed = 1 if source_sides % sides == 0 else min_num_dice(source_sides, sides)
+            if source_count and int(source_count) != needed:
+                raise ValueError('A d{} is made from {}d{}, not {!r}.'.format(sides, needed, source_sides, match.group(0)))
+            source_count = needed
+
+        terms.append(DiceTerm(sign, count, sides, keep, num_kept, source_count, source_sides))
+
+    return terms
+
+def normalize_expression(terms):
+    """ Return the canonical text of parsed terms, used as the plan cache key. """
+    a = []
+    for term in terms:
+        if isinstance(term, int):
+            a.append('{:+d}'.format(term))
+            continue
+
+        s = '{}{}d{}'.format('-' if term.sign < 0 else '+', term.count, term.sides)
+        if term.keep and term.num_kept < term.count:
+            s += '{}{}'.format(term.keep, term.num_kept)
+        if term.source_sides is not None:
+            s += ' from {}d{}'.format(term.source_count, term.source_sides)
+        a.append(s)
+
+    return ' '.join(a).lstrip('+')
+
+class DieExpression(DieBase):
+    """ A compiled dice expression that rolls whole batches with numpy.
+
+    Each dice term has its own die, a Die or, for 'from', a compiled
+    DieDivider or DieCombo over a Die. A batch of count results draws a
+    (count, dice) matrix for every term, keeps the highest or lowest dice
+    with a sort, and sums the terms. The results lie from minimum to sides.
+    """
+    def __init__(self, terms):
+        self.terms = [t for t in terms if not isinstance(t, int)]
+        self.constant = sum(t for t in terms if isinstance(t, int))
+        self.text = normalize_expression(terms)
+
+        self.dice = []
+        for term in self.terms:
+            if term.source_sides is None:
+                self.dice.append(Die(sides=term.sides))
+            elif term.source_sides % term.sides == 0:
+                self.dice.append(compile_die(DieDivider(sides=term.sides, source=Die(sides=term.source_sides))))
+            else:
+                self.dice.append(compile_die(DieCombo(sides=term.sides, source=Die(sides=term.source_sides))))
+
+        low = [t.num_kept if t.sign > 0 else -t.num_kept * t.sides for t in self.terms]
+        high = [t.num_kept * t.sides if t.sign > 0 else -t.num_kept for t in self.terms]
+        super(DieExpression, self).__init__(sides=sum(high) + self.constant, source=None)
+        self.minimum = sum(low) + self.constant
+
+    def reseed(self, seed):
+        for (die, child) in zip(self.dice, seed_sequence(seed).spawn(len(self.dice))):
+            die.reseed(child)
+
+    def sources(self):
+        return self.dice
+
+    @property
+    def bits_produced(self):
+        # The results are not uniform, so there is no simple entropy per roll.
+        return math.nan
+
+    def roll(self):
+        return int(self.roll_batch(1)[0])
+
+    def roll_batch(self, count=1):
+        total = np.full(count, self.constant, dtype=np.int64)
+        for (term, die) in zip(self.terms, self.dice):
+            rolls = die.roll_batch(count * term.count).reshape(count, term.count)
+            if term.num_kept < term.count:
+                rolls = np.sort(rolls, axis=1)
+                rolls = rolls[:, -term.num_kept:] if term.keep == 'kh' else rolls[:, :term.num_kept]
+            total += term.sign * rolls.sum(axis=1)
+
+        self.num_outputs += count
+        return total
+
+    def __str__(self):
+        return 'expression={}, minimum={}, maximum={}'.format(self.text, self.minimum, self.sides)
+
+@functools.lru_cache(maxsize=1024)
+def canonical_terms(text):
+    """ Return the terms of a normalized expression, one tuple per expression. """
+    return tuple(parse_expression(text))
+
+@functools.lru_cache(maxsize=1024)
+def plan_expression(text):
+    """ Return the cached terms for text, shared between equivalent spellings. """
+    return canonical_terms(normalize_expression(parse_expression(text)))
+
+def compile_expression(text, seed=None):
+    """ Return a new DieExpression for text, with its own dice and counters.
+
+    Only the parsed plan is cached. The converter tables of 'from' terms come
+    from table_cache, so building the die is cheap, and dice made from the
+    same text never share a generator.
+    """
+    die = DieExpression(plan_expression(text))
+    if seed is not None:
+        die.reseed(seed)
+    return die
+
+class TestDieExpression(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(normalize_expression(parse_expression('3d6+2')), '3d6 +2')
+        self.assertEqual(normalize_expression(parse_expression(' 4D6 kh3 ')), '4d6kh3')
+        self.assertEqual(normalize_expression(parse_expression('d45 from 2d10')), '1d45 from 2d10')
+        self.assertEqual(normalize_expression(parse_expression('d3 from d6 - 1 + 2d20kl1')), '1d3 from 1d6 -1 +2d20kl1')
+        for text in ('', '3d', 'd6 d6', '2d6kh3', 'd45 from 3d10', '3d6 * 2', 'd6 from d1'):
+            with self.assertRaises(ValueError):
+                parse_expression(text)
+
+    def test_cache(self):
+        a = plan_expression('3d6+2')
+        self.assertIs(plan_expression('3d6+2'), a)
+        self.assertIs(plan_expression('3D6 + 2'), a)
+        self.assertIsNot(plan_expression('3d6+3'), a)
+
+    def test_independent(self):
+        # Each die has its own generators and counters.
+        a = compile_expression('3d6 + d45 from 2d10', seed=1)
+        b = compile_expression('3D6 + d45 from 2d10', seed=1)
+        self.assertIsNot(a, b)
+        self.assertIs(a.terms[1], b.terms[1])
+        self.assertEqual(a.roll_batch(count=100).tolist(), b.roll_batch(count=100).tolist())
+        b.reseed(2)
+        self.assertEqual(a.roll_batch(count=100).tolist(), compile_expression('3d6 + d45 from 2d10', seed=1).roll_batch(count=200)[100:].tolist())
+        self.assertEqual(a.num_outputs, 200)
+        self.assertEqual(b.num_outputs, 100)
+
+    def test_range(self):
+        die = DieExpression(parse_expression('3d6+2'))
+        die.reseed(1)
+        rolls = die.roll_batch(count=10000)
+        self.assertEqual((die.minimum, die.sides), (5, 20))
+        self.assertEqual((rolls.min(), rolls.max()), (5, 20))
+        self.assertAlmostEqual(rolls.mean(), 12.5, delta=0.1)
+
+    def test_keep(self):
+        die = DieExpression(parse_expression('4d6kh3'))
+        die.reseed(2)
+        rolls = die.roll_batch(count=5)
+
+        dice = Die(sides=6, seed=np.random.SeedSequence(2).spawn(1)[0]).roll_batch(count=20).reshape(5, 4)
+        self.assertEqual(rolls.tolist(), [sum(sorted(r)[1:]) for r in dice.tolist()])
+        self.assertEqual((die.minimum, die.sides), (3, 18))
+
+        die = DieExpression(parse_expression('2d20kl1 - d4'))
+        self.assertEqual((die.minimum, die.sides), (-3, 19))
+        die(count=10)
+        self.assertEqual(len(die.report().splitlines()), 3)
+
+    def test_from(self):
+        die = DieExpression(parse_expression('d45 from 2d10'))
+        die.reseed(3)
+        source = Die(sides=10, seed=np.random.SeedSequence(3).spawn(1)[0])
+        self.assertEqual(die.roll_batch(count=100).tolist(), DieCombo(sides=45, source=source)(count=100))
+
+Distribution = namedtuple('Distribution', ['minimum', 'probabilities', 'counts'])
+Distribution.__doc__ = """ The exact distribution of a roll.
+
+probabilities[i] is the chance of rolling minimum + i. counts holds the
+number of ways to roll each value as exact integers, or None when the
+distribution was computed with floating point FFTs.
+"""
+
+def multiply_counts(a, b):
+    """ Multiply two polynomials with non-negative integer coefficients exactly.
+
+    The coefficients are packed into one big integer each (Kronecker
+    substitution), so the product is a single big integer multiplication.
+    """
+    bits = max(a).bit_length() + max(b).bit_length() + min(len(a), len(b)).bit_length() + 1
+    width = (bits + 7) // 8
+
+    def pack(c):
+        return int.from_bytes(b''.join(x.to_bytes(width, 'little') for x in c), 'little')
+
+    length = len(a) + len(b) - 1
+    product = (pack(a) * pack(b)).to_bytes(width * length, 'little')
+    return tuple(int.from_bytes(product[i * width:(i + 1) * width], 'little') for i in range(0, length))
+
+def fft_convolve(a, b):
+    """ Convolve two probability vectors with a real FFT. """
+    length = len(a) + len(b) - 1
+    size = 1 << (length - 1).bit_length()
+    c = np.fft.irfft(np.fft.rfft(a, size) * np.fft.rfft(b, size), size)[:length]
+    return np.clip(c, 0, None)
+
+@functools.lru_cache(maxsize=256)
+def sum_counts(sides, num_dice):
+    """ Ways to roll each total from num_dice to num_dice * sides with num_dice dice.
+
+    Powers are built by repeated squaring and each one is cached, so 100d20
+    reuses 50d20, 25d20 and so on.
+    """
+    if num_dice == 1:
+        return (1,) * sides
+
+    half = sum_counts(sides, num_dice // 2)
+    counts = multiply_counts(half, half)
+    if num_dice % 2:
+        counts = multiply_counts(counts, sum_counts(sides, 1))
+    return counts
+
+def exact_counts(counts):
+    total = sum(counts)
+    return Distribution(None, np.array([c / total for c in counts]), counts)
+
+def sum_distribution(sides, num_dice, exact=None):
+    """ The distribution of the total of num_dice dice with sides sides.
+
+    Small cases are computed exactly with big integers. When exact is None,
+    cases where the exact counts would hold more than about 10**7 bits are
+    computed with an FFT instead.
+    """
+    length = num_dice * (sides - 1) + 1
+    if exact is None:
+        exact = length * num_dice * math.log2(sides) <= 10000000
+
+    if exact:
+        return exact_counts(sum_counts(sides, num_dice))._replace(minimum=num_dice)
+
+    p = np.fft.rfft(np.full(sides, 1 / sides), 1 << (length - 1).bit_length())
+    probabilities = np.clip(np.fft.irfft(p ** num_dice)[:length], 0, None)
+    return Distribution(num_dice, probabilities / probabilities.sum(), None)
+
+@functools.lru_cache(maxsize=256)
+def keep_counts(sides, num_dice, keep, num_kept):
+    """ Ways to roll each total of the num_kept highest ('kh') or lowest ('kl') of num_dice dice.
+
+    The faces are visited from the best to the worst. For each one, every
+    number of dice that could show it is counted with a binomial coefficient,
+    and those that are still within the first num_kept add to the total.
+    """
+    faces = range(sides, 0, -1) if keep == 'kh' else range(1, sides + 1)
+    ways = {(0, 0): 1}
+    for face in faces:
+        new = {}
+        for ((assigned, total), w) in ways.items():
+            for j in range(0, num_dice - assigned + 1):
+                kept = min(j, max(0, num_kept - assigned))
+                key = (assigned + j, total + kept * face)
+                new[key] = new.get(key, 0) + w * math.comb(num_dice - assigned, j)
+        ways = new
+
+    counts = [0] * (num_kept * (sides - 1) + 1)
+    for ((assigned, total), w) in ways.items():
+        if assigned == num_dice:
+            counts[total - num_kept] += w
+    return tuple(counts)
+
+def expression_distribution(die, exact=None):
+    """ The distribution of a DieExpression, from the distribution of each term. """
+    minimum = die.constant
+    counts = (1,)
+    probabilities = np.ones(1)
+    for term in die.terms:
+        if term.num_kept < term.count:
+            d = exact_counts(keep_counts(term.sides, term.count, term.keep, term.num_kept))._replace(minimum=term.num_kept)
+        else:
+            d = sum_distribution(term.sides, term.count, exact=exact)
+
+        if term.sign > 0:
+            minimum += d.minimum
+            (c, p) = (d.counts, d.probabilities)
+        else:
+            minimum -= d.minimum + len(d.probabilities) - 1
+            (c, p) = (d.counts[::-1] if d.counts else None, d.probabilities[::-1])
+
+        if counts is not None and c is not None:
+            counts = multiply_counts(counts, c)
+            continue
+
+        if counts is not None:
+            # Carry the exact terms so far over to floating point.
+            probabilities = exact_counts(counts).probabilities
+            counts = None
+        probabilities = fft_convolve(probabilities, p)
+
+    if counts is not None:
+        return exact_counts(counts)._replace(minimum=minimum)
+    return Distribution(minimum, probabilities / probabilities.sum(), None)
+
+def distribution(die, exact=None):
+    """ The exact distribution of a die: a DieExpression, or any uniform die. """
+    if isinstance(die, DieExpression):
+        return expression_distribution(die, exact=exact)
+    return exact_counts((1,) * die.sides)._replace(minimum=1)
+
+class TestDistribution(unittest.TestCase):
+    def test_multiply_counts(self):
+        self.assertEqual(multiply_counts((1, 1), (1, 1)), (1, 2, 1))
+        self.assertEqual(multiply_counts((3,), (pow(10, 30), 0, 1)), (3 * pow(10, 30), 0, 3))
+
+    def test_sum(self):
+        d = sum_distribution(6, 2)
+        self.assertEqual(d.minimum, 2)
+        self.assertEqual(d.counts, (1, 2, 3, 4, 5, 6, 5, 4, 3, 2, 1))
+        self.assertEqual(d.counts, multiply_counts(sum_counts(6, 1), sum_counts(6, 1)))
+        self.assertEqual(sum(sum_counts(20, 100)), pow(20, 100))
+        self.assertEqual(sum_counts(6, 3)[7], 27)
+
+    def test_fft(self):
+        exact = sum_distribution(20, 100, exact=True)
+        fft = sum_distribution(20, 100, exact=False)
+        self.assertEqual(exact.minimum, fft.minimum)
+        self.assertTrue(np.abs(exact.probabilities - fft.probabilities).max() < 1e-12)
+        self.assertAlmostEqual(float(np.arange(100, 2001) @ fft.probabilities), 1050)
+
+    def test_keep(self):
+        counts = keep_counts(6, 4, 'kh', 3)
+        brute = [0] * 16
+        for r in itertools.product(range(1, 7), repeat=4):
+            brute[sum(sorted(r)[1:]) - 3] += 1
+        self.assertEqual(list(counts), brute)
+
+        counts = keep_counts(20, 2, 'kl', 1)
+        self.assertEqual(list(counts), [2 * (20 - v) + 1 for v in range(1, 21)])
+
+    def test_expression(self):
+        d = distribution(DieExpression(parse_expression('2d6 - d4 + 3')))
+        self.assertEqual(d.minimum, 2 - 4 + 3)
+        self.assertEqual(len(d.probabilities), 14)
+        self.assertEqual(sum(d.counts), 144)
+        self.assertAlmostEqual(float(np.arange(d.minimum, d.minimum + 14) @ d.probabilities), 7 - 2.5 + 3)
+
+    def test_mixed(self):
+        # Exact terms before an FFT term are kept.
+        d = distribution(DieExpression(parse_expression('4d6kh3 + 2d6')), exact=False)
+        self.assertEqual((d.minimum, len(d.probabilities)), (5, 26))
+        self.assertIsNone(d.counts)
+        exact = distribution(DieExpression(parse_expression('4d6kh3 + 2d6')), exact=True)
+        self.assertTrue(np.abs(d.probabilities - exact.probabilities).max() < 1e-12)
+
+        d = distribution(DieExpression(parse_expression('2d6 + 400d100')))
+        self.assertEqual((d.minimum, len(d.probabilities)), (402, 39611))
+        self.assertAlmostEqual(float(np.arange(402, 402 + 39611) @ d.probabilities), 7 + 400 * 50.5, places=6)
+
+    def test_tester(self):
+        die = DieExpression(parse_expression('4d6kh3 + 1'))
+        die.reseed(1)
+        tester = DieTester(die, expected=distribution(die).probabilities)
+        tester(count=100000)
+        logging.info(tester)
+        self.assertEqual(tester.minimum, 4)
+        self.assertTrue(tester.chi_square().p_value > 0.001)
+        self.assertTrue(tester.ks_test().p_value > 0.001)
+        self.assertTrue(tester.average_deviation < 0.05)
+
+        # The same rolls are far from uniform.
+        uniform = DieTester(die)
+        uniform.update(die.roll_batch(count=10000))
+        self.assertTrue(uniform.chi_square().p_value < 1e-6)
+
+    def test_impossible(self):
+        die = DiePerfect(sides=3)
+        tester = DieTester(die, expected=[0.5, 0.5, 0])
+        tester(count=3)
+        self.assertEqual(tester.chi_square(), (math.inf, 0))
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO, format='%(message)s')
     unittest.main()
\ No newline at end of file
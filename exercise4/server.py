@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+""" Serve rolls from a die over a Unix or TCP socket.
+
+Requests and responses are one JSON object per line. A request of
+{"count": 3} is answered with {"rolls": [...]}, and {"stats": true} with the
+server statistics. Requests waiting at the same time are merged into one
+roll_batch call and the rolls are split back out in the order the requests
+arrived, so each connection gets its rolls in the order it asked for them.
+
+The tests are run with: python -m unittest server
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import unittest
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from dice import Die, DieCombo, DiePerfect
+
+class RollServer:
+    def __init__(self, die, max_count=1000000, max_batch=1000000, max_delay=0.0, num_latencies=10000):
+        self.die = die
+        self.max_count = max_count
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        self.queue = None
+        self.carry = None
+        self.server = None
+        self.batcher = None
+
+        # A single thread keeps the batches in order without blocking the event loop.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.num_requests = 0
+        self.num_rolls = 0
+        self.num_batches = 0
+        self.latencies = deque(maxlen=num_latencies)
+        self.start_time = time.monotonic()
+
+    async def start_unix(self, path):
+        self.start_batcher()
+        self.server = await asyncio.start_unix_server(self.handle, path=path)
+        return self.server
+
+    async def start_tcp(self, host='127.0.0.1', port=0):
+        self.start_batcher()
+        self.server = await asyncio.start_server(self.handle, host=host, port=port)
+        return self.server
+
+    def start_batcher(self):
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.get_running_loop().create_task(self.run_batcher())
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.batcher is not None:
+            self.batcher.cancel()
+        self.executor.shutdown()
+
+    async def roll(self, count):
+        """ Queue a request for count rolls and wait for them. """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((count, future, time.monotonic()))
+        return await future
+
+    async def run_batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [self.carry or await self.queue.get()]
+            total = requests[0][0]
+            self.carry = None
+
+            if self.max_delay:
+                await asyncio.sleep(self.max_delay)
+
+            # Take everything else that is already waiting, up to max_batch rolls.
+            while not self.queue.empty():
+                request = self.queue.get_nowait()
+                if total + request[0] > self.max_batch:
+                    self.carry = request
+                    break
+                requests.append(request)
+                total += request[0]
+
+            try:
+                rolls = await loop.run_in_executor(self.executor, self.die.roll_batch, total)
+            except Exception as e:
+                for (count, future, start) in requests:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.num_batches += 1
+            offset = 0
+            now = time.monotonic()
+            for (count, future, start) in requests:
+                # A cancelled request still used its rolls, so the others stay in order.
+                if not future.done():
+                    future.set_result(rolls[offset:offset + count].tolist())
+                offset += count
+                self.num_requests += 1
+                self.num_rolls += count
+                self.latencies.append(now - start)
+
+    def stats(self):
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        elapsed = time.monotonic() - self.start_time
+        return {
+            'requests': self.num_requests,
+            'rolls': self.num_rolls,
+            'batches': self.num_batches,
+            'requests_per_batch': self.num_requests / self.num_batches if self.num_batches else 0,
+            'rolls_per_second': self.num_rolls / elapsed if elapsed else 0,
+            'latency_p50': float(np.percentile(latencies, 50)),
+            'latency_p99': float(np.percentile(latencies, 99)),
+            'latency_max': float(latencies.max()),
+        }
+
+    async def handle(self, reader, writer):
+        # Responses are written in the order the requests were read.
+        pending = asyncio.Queue()
+
+        async def respond():
+            while True:
+                future = await pending.get()
+                if future is None:
+                    break
+                writer.write(json.dumps(await future).encode() + b'\n')
+                await writer.drain()
+
+        responder = asyncio.get_running_loop().create_task(respond())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await pending.put(asyncio.ensure_future(self.request(line)))
+        finally:
+            await pending.put(None)
+            await responder
+            writer.close()
+
+    async def request(self, line):
+        try:
+            request = json.loads(line)
+            if request.get('stats'):
+                return self.stats()
+
+            count = request['count']
+            if not isinstance(count, int) or isinstance(count, bool) or not 0 < count <= self.max_count:
+                return {'error': 'count must be from 1 to {}'.format(self.max_count)}
+
+            return {'rolls': await self.roll(count)}
+        except (ValueError, KeyError, AttributeError) as e:
+            return {'error': 'bad request: {}'.format(e)}
+        except Exception as e:
+            logging.exception('roll failed')
+            return {'error': str(e)}
+
+class RollClient:
+    """ Ask a RollServer for rolls. Several requests can be in flight at once. """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = deque()
+        self.receiver = asyncio.get_running_loop().create_task(self.receive())
+
+    @classmethod
+    async def connect_unix(cls, path):
+        (reader, writer) = await asyncio.open_unix_connection(path=path)
+        return cls(reader, writer)
+
+    @classmethod
+    async def connect_tcp(cls, host, port):
+        (reader, writer) = await asyncio.open_connection(host=host, port=port)
+        return cls(reader, writer)
+
+    async def receive(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            # Responses come in request order, so a cancelled request still takes its response.
+            future = self.pending.popleft()
+            if not future.done():
+                future.set_result(json.loads(line))
+
+        for future in self.pending:
+            if not future.done():
+                future.set_exception(ConnectionError('Connection closed by the server.'))
+
+    async def request(self, request):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(future)
+        self.writer.write(json.dumps(request).encode() + b'\n')
+        await self.writer.drain()
+        response = await future
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response
+
+    async def roll(self, count=1):
+        return (await self.request({'count': count}))['rolls']
+
+    async def stats(self):
+        return await self.request({'stats': True})
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        await self.receiver
+
+class TestRollServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'dice.sock')
+        self.server = RollServer(DiePerfect(sides=100000))
+        await self.server.start_unix(self.path)
+
+    async def asyncTearDown(self):
+        await self.server.close()
+        self.dir.cleanup()
+
+    async def test_roll(self):
+        client = await RollClient.connect_unix(self.path)
+        self.assertEqual(await client.roll(3), [1, 2, 3])
+        self.assertEqual(await client.roll(2), [4, 5])
+        await client.close()
+
+    async def test_coalesce(self):
+        clients = [await RollClient.connect_unix(self.path) for i in range(0, 4)]
+        results = await asyncio.gather(*[asyncio.gather(*[c.roll(3) for i in range(0, 50)]) for c in clients])
+
+        # Every request gets consecutive rolls, and each session's requests are in order.
+        rolls = []
+        for session in results:
+            flat = [r for request in session for r in request]
+            self.assertEqual(flat, sorted(flat))
+            for request in session:
+                self.assertEqual(request, list(range(request[0], request[0] + 3)))
+            rolls.extend(flat)
+        self.assertEqual(sorted(rolls), list(range(1, 601)))
+
+        stats = await clients[0].stats()
+        logging.info(stats)
+        self.assertEqual(stats['requests'], 200)
+        self.assertTrue(stats['batches'] < 200)
+        for c in clients:
+            await c.close()
+
+    async def test_errors(self):
+        client = await RollClient.connect_unix(self.path)
+        with self.assertRaises(ValueError):
+            await client.roll(0)
+        with self.assertRaises(ValueError):
+            await client.request({'size': 1})
+        with self.assertRaises(ValueError):
+            await client.request({'count': True})
+        self.assertEqual(await client.roll(1), [1])
+        await client.close()
+
+    async def test_cancel(self):
+        class DieSlow(DiePerfect):
+            def roll_batch(self, count=1):
+                time.sleep(0.1)
+                return super(DieSlow, self).roll_batch(count)
+
+        server = RollServer(DieSlow(sides=100))
+        await server.start_unix(os.path.join(self.dir.name, 'slow.sock'))
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(server.roll(3), 0.01)
+        self.assertEqual(await server.roll(2), [4, 5])
+        self.assertFalse(server.batcher.done())
+
+        client = await RollClient.connect_unix(os.path.join(self.dir.name, 'slow.sock'))
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(client.roll(3), 0.01)
+        self.assertEqual(await client.roll(2), [9, 10])
+        await client.close()
+        await server.close()
+
+    async def test_tcp(self):
+        server = RollServer(DieCombo(sides=45, source=Die(sides=10, seed=1)))
+        tcp = await server.start_tcp()
+        (host, port) = tcp.sockets[0].getsockname()[:2]
+        client = await RollClient.connect_tcp(host, port)
+        rolls = await client.roll(100)
+        self.assertEqual(rolls, DieCombo(sides=45, source=Die(sides=10, seed=1)).roll_batch(100).tolist())
+        await client.close()
+        await server.close()
+
+async def serve(args):
+    source = Die(sides=args.source) if args.source else None
+    die = DieCombo(sides=args.sides, source=source) if source else Die(sides=args.sides)
+    server = RollServer(die, max_delay=args.delay)
+    if args.unix:
+        s = await server.start_unix(args.unix)
+    else:
+        s = await server.start_tcp(args.host, args.port)
+    logging.info('Serving {} on {}'.format(die, [sock.getsockname() for sock in s.sockets]))
+    async with s:
+        await s.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sides', type=int, default=6, help='sides of the served die')
+    parser.add_argument('--source', type=int, help='make the die from a die with this many sides')
+    parser.add_argument('--unix', help='listen on this Unix socket path')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7666)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait for more requests to merge')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    asyncio.run(serve(args))
+
+if __name__ == '__main__':
+    main()